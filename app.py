@@ -1,26 +1,36 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for
-import pymysql
+from flask import Flask, render_template, jsonify, request, redirect, url_for, Response
 import json
+import os
+import queue
+import threading
 from contextlib import contextmanager
+from events import VersionWatcher, retry_with_jitter, format_sse
+from singleflight import SingleFlight
+from compression import CompressedPayload, PayloadCache, compress_response
+from data_version import dependency_stamp, fetch_versions, version_token
+from city_dim import DIM_TABLE, default_index, load_index
+from warmup import Warmup
+from storage import MYSQL_CONFIG, config_from_env, create_backend
+# rollup / forecast / quality 依赖 NumPy，在用到时才导入（启动预热时在后台线程中完成），
+# 不拖慢服务开始监听的时间
 
 app = Flask(__name__)
 
-# 数据库配置
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '123456',
-    'database': 'housing_price',
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
+# 数据库配置（MySQL 连接参数见 storage.MYSQL_CONFIG，命令行工具共用）
+DB_CONFIG = dict(MYSQL_CONFIG)
+
+# 存储后端配置：'mysql' 使用上面的 DB_CONFIG；'sqlite' 使用由 data/*.csv 生成的内嵌数据库，不需要数据库服务
+# 可用环境变量 HOUSING_STORAGE / HOUSING_SQLITE_PATH / HOUSING_SQLITE_READ_ONLY 或启动参数覆盖
+STORAGE_CONFIG = config_from_env()
+
+db_backend = create_backend(STORAGE_CONFIG, DB_CONFIG)
 
 @contextmanager
 def get_db_connection():
     """使用上下文管理器获取数据库连接，确保连接正确关闭"""
     conn = None
     try:
-        conn = pymysql.connect(**DB_CONFIG)
+        conn = db_backend.connect()
         yield conn
     except Exception as e:
         print(f"数据库连接错误: {e}")
@@ -31,10 +41,168 @@ def get_db_connection():
         if conn:
             conn.close()
 
-def get_all_cities():
+@contextmanager
+def use_connection(conn=None):
+    """传入连接时直接复用（批量查询共享同一连接），在批量请求的快照内时复用快照连接，否则新建连接"""
+    if conn is None:
+        conn = snapshot_connection()
+    if conn is not None:
+        yield conn
+    else:
+        with get_db_connection() as conn:
+            yield conn
+
+@contextmanager
+def get_snapshot_connection():
+    """只读一致性快照连接：同一事务内的多次查询看到同一版本的数据"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+def parse_month(value, default_month=1):
+    """
+    解析 'YYYY-MM' 或 'YYYY' 格式的时间
+
+    Args:
+        value: 时间字符串或年份
+        default_month: 只给年份时使用的月份（起始用1，结束用12）
+
+    Returns:
+        tuple: (year, month)，无效时返回 None
+    """
+    if value is None or value == '':
+        return None
+    parts = str(value).split('-')
+    try:
+        year = int(parts[0])
+        month = int(parts[1]) if len(parts) > 1 else default_month
+    except ValueError:
+        return None
+    if not 1 <= month <= 12:
+        return None
+    return (year, month)
+
+def previous_month(year_month):
+    """上一个月的 (year, month)"""
+    year, month = year_month
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+def month_range_clause(start=None, end=None):
+    """
+    月度时间范围过滤条件，使用 (year, month) 行比较以便走 (year, month) 索引
+
+    Returns:
+        tuple: (以 AND 开头的SQL片段, 参数列表)
+    """
+    clause = ''
+    params = []
+    if start:
+        clause += " AND (year, month) >= (%s, %s)"
+        params.extend(start)
+    if end:
+        clause += " AND (year, month) <= (%s, %s)"
+        params.extend(end)
+    return clause, params
+
+def year_range_clause(start=None, end=None):
+    """年度时间范围过滤条件，start / end 为 (year, month)，只取年份"""
+    clause = ''
+    params = []
+    if start:
+        clause += " AND year >= %s"
+        params.append(start[0])
+    if end:
+        clause += " AND year <= %s"
+        params.append(end[0])
+    return clause, params
+
+# 数据版本监听（每个进程一个后台轮询线程，首次订阅时启动）
+version_watcher = VersionWatcher(get_db_connection, poll_interval=5)
+
+# 批量请求执行期间当前线程的一致性快照：快照连接和在快照中读到的数据版本。
+# 城市索引、数据质量标记、汇总、预测模型等派生结果在快照内按快照的数据版本取缓存，
+# 未命中时在快照连接上计算，批量请求的所有子查询因此看到同一版本的数据
+_active_snapshot = threading.local()
+
+@contextmanager
+def snapshot_scope(conn, versions):
+    """在快照内执行派生数据的查找"""
+    _active_snapshot.conn = conn
+    _active_snapshot.versions = versions
+    try:
+        yield
+    finally:
+        _active_snapshot.conn = None
+        _active_snapshot.versions = None
+
+def snapshot_connection():
+    """当前线程所在快照的连接，不在批量请求中时为 None"""
+    return getattr(_active_snapshot, 'conn', None)
+
+def current_versions():
+    """派生数据所依据的各表版本：批量请求中取快照中的版本，否则取版本监听的最新结果"""
+    versions = getattr(_active_snapshot, 'versions', None)
+    if versions is not None:
+        return versions
+    version_watcher.start()
+    return version_watcher.snapshot()['tables']
+
+# 城市别名索引：参考数据 + 数据库中登记的新城市，city_dim 版本变化后重新加载
+_city_index = {'version': None, 'index': None}
+
+def get_city_index():
+    """获取城市别名索引，数据库不可用时退回参考数据"""
+    version = current_versions().get(DIM_TABLE, {}).get('version')
+    if _city_index['index'] is None or _city_index['version'] != version:
+        try:
+            with use_connection() as conn:
+                index = load_index(conn)
+        except Exception as e:
+            print(f"⚠️  加载城市维度表失败，使用参考数据: {e}")
+            index = default_index()
+        _city_index.update(version=version, index=index)
+    return _city_index['index']
+
+def normalize_cities(cities):
+    """把请求中的城市名统一为数据表中的写法（去重并保持顺序）"""
+    index = get_city_index()
+    normalized = []
+    for city in cities:
+        name = index.canonical_name(city)
+        if name and name not in normalized:
+            normalized.append(name)
+    return normalized
+
+def city_info(city_name):
+    """地图等接口附带的城市维度信息，未登记的城市返回空字典"""
+    city = get_city_index().resolve(city_name)
+    if not city:
+        return {}
+    return {
+        'cityId': city['city_id'],
+        'displayName': city['display_name'],
+        'nameZh': city['name_zh'],
+        'province': city['province'],
+        'provinceEN': city['province_en'],
+        'capital': city['is_capital'],
+        'coord': [city['lon'], city['lat']] if city['lat'] is not None else None
+    }
+
+def valid_price(row, masked):
+    """行的有效价格；缺失、非正数或被数据质量检查标记时返回 None（年度行没有 month）"""
+    if row['price'] is None or (row['city_name'], row['year'], row.get('month')) in masked:
+        return None
+    price = float(row['price'])
+    return price if price > 0 else None
+
+def get_all_cities(conn=None):
     """获取所有城市列表 - 从年度表获取"""
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
                 query = "SELECT DISTINCT city_name FROM yearly_price_for_all ORDER BY city_name"
                 cursor.execute(query)
@@ -44,10 +212,10 @@ def get_all_cities():
         print(f"获取城市列表错误: {e}")
         return []
 
-def get_all_cities_monthly():
+def get_all_cities_monthly(conn=None):
     """获取所有城市列表 - 从月度表获取"""
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
                 query = "SELECT DISTINCT city_name FROM monthly_price_for_all ORDER BY city_name"
                 cursor.execute(query)
@@ -57,67 +225,132 @@ def get_all_cities_monthly():
         print(f"获取城市列表错误: {e}")
         return []
 
-def get_multi_city_data(cities):
-    """获取多个城市的年度数据"""
+def get_page_cities(source='monthly'):
+    """页面城市列表，按数据版本缓存（启动预热时预先加载）"""
+    def compute():
+        cities = get_all_cities_monthly() if source == 'monthly' else get_all_cities()
+        return cities, bool(cities)
+
+    return derived_for_version(('cities', source), compute, [(f'{source}_price_for_all', None)])
+
+def has_city_id_column(table_name, conn=None):
+    """价格表是否已有 city_id 列（未运行 city_dim.py sync 的旧库没有），按数据版本缓存"""
+    def compute():
+        try:
+            with use_connection(conn) as active:
+                with active.cursor() as cursor:
+                    cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'city_id'")
+                    found = cursor.fetchone() is not None
+        except Exception as e:
+            print(f"⚠️  检查 {table_name} 的 city_id 列失败，按城市名查询: {e}")
+            return False, False
+        if not found:
+            print(f"⚠️  {table_name} 没有 city_id 列，按城市名查询；运行 python city_dim.py sync 后可按城市ID走索引")
+        return found, True
+
+    return derived_for_version(('city_id_column', table_name), compute, [(table_name, None), (DIM_TABLE, None)])
+
+def city_filter_clause(table_name, cities, conn=None):
+    """
+    按城市过滤的条件，有 city_id 列时按整数ID过滤，否则退回按城市名过滤
+
+    Returns:
+        tuple: (SQL条件, 参数列表)，没有可查询的城市时条件为 None
+    """
+    if has_city_id_column(table_name, conn):
+        column, values = 'city_id', get_city_index().ids_of(cities)
+    else:
+        column, values = 'city_name', list(cities)
+    if not values:
+        return None, []
+    return f"{column} IN ({','.join(['%s'] * len(values))})", values
+
+def get_multi_city_data(cities, conn=None, start=None, end=None):
+    """获取多个城市的年度数据，start / end 为 (year, month)"""
     if not cities:
         return []
     
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
-                placeholders = ','.join(['%s'] * len(cities))
+                city_clause, city_params = city_filter_clause('yearly_price_for_all', cities, conn)
+                if city_clause is None:
+                    return []
+                range_clause, range_params = year_range_clause(start, end)
                 query = f"""
                     SELECT city_name, year, price, change_rate 
                     FROM yearly_price_for_all 
-                    WHERE city_name IN ({placeholders})
+                    WHERE {city_clause}{range_clause}
                     ORDER BY city_name, year
                 """
-                cursor.execute(query, cities)
+                cursor.execute(query, city_params + range_params)
                 results = cursor.fetchall()
+
+                # 数据质量检查标记为不可用的数据按缺失处理
+                masked = get_quality_mask('yearly_price_for_all', conn)
+                for row in results:
+                    if (row['city_name'], row['year'], None) in masked:
+                        row['price'] = None
+                        row['change_rate'] = None
                 return results
     except Exception as e:
         print(f"获取城市数据错误: {e}")
         return []
 
-def get_multi_city_monthly_data(cities):
-    """获取多个城市的月度数据"""
+def get_multi_city_monthly_data(cities, conn=None, start=None, end=None):
+    """获取多个城市的月度数据，start / end 为 (year, month)"""
     if not cities:
         return []
     
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
-                placeholders = ','.join(['%s'] * len(cities))
+                city_clause, city_params = city_filter_clause('monthly_price_for_all', cities, conn)
+                if city_clause is None:
+                    return []
+                range_clause, range_params = month_range_clause(start, end)
                 query = f"""
                     SELECT city_name, year, month, price 
                     FROM monthly_price_for_all 
-                    WHERE city_name IN ({placeholders})
+                    WHERE {city_clause}{range_clause}
                     ORDER BY city_name, year, month
                 """
-                cursor.execute(query, cities)
+                cursor.execute(query, city_params + range_params)
                 results = cursor.fetchall()
+
+                # 数据质量检查标记为不可用的数据按缺失处理
+                masked = get_quality_mask('monthly_price_for_all', conn)
+                for row in results:
+                    if (row['city_name'], row['year'], row['month']) in masked:
+                        row['price'] = None
                 return results
     except Exception as e:
         print(f"获取城市月度数据错误: {e}")
         return []
 
-def get_multi_city_monthly_change_rate_data(cities):
-    """获取多个城市的月度涨跌幅数据 - 基于月度价格计算环比"""
+def get_multi_city_monthly_change_rate_data(cities, conn=None, start=None, end=None):
+    """获取多个城市的月度涨跌幅数据 - 基于月度价格计算环比，start / end 为 (year, month)"""
     if not cities:
         return []
     
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
-                placeholders = ','.join(['%s'] * len(cities))
+                city_clause, city_params = city_filter_clause('monthly_price_for_all', cities, conn)
+                if city_clause is None:
+                    return []
+                # 多取起始月的上一个月，起始月才有环比数据
+                query_start = previous_month(start) if start else None
+                range_clause, range_params = month_range_clause(query_start, end)
                 query = f"""
                     SELECT city_name, year, month, price 
                     FROM monthly_price_for_all 
-                    WHERE city_name IN ({placeholders})
+                    WHERE {city_clause}{range_clause}
                     ORDER BY city_name, year, month
                 """
-                cursor.execute(query, cities)
+                cursor.execute(query, city_params + range_params)
                 results = cursor.fetchall()
+                masked = get_quality_mask('monthly_price_for_all', conn)
                 
                 # 计算环比涨跌幅
                 city_data = {}
@@ -134,20 +367,25 @@ def get_multi_city_monthly_change_rate_data(cities):
                         if i == 0:
                             # 第一个月没有环比数据
                             continue
+                        if start and (data[i]['year'], data[i]['month']) < start:
+                            continue
                         
-                        current_price = float(data[i]['price']) if data[i]['price'] else 0
-                        previous_price = float(data[i-1]['price']) if data[i-1]['price'] else 0
+                        current_price = valid_price(data[i], masked)
+                        previous_price = valid_price(data[i-1], masked)
+                        consecutive = previous_month((data[i]['year'], data[i]['month'])) == \
+                            (data[i-1]['year'], data[i-1]['month'])
                         
-                        if previous_price > 0:
-                            change_rate = ((current_price - previous_price) / previous_price) * 100
+                        # 任一端缺失、不可用或中间缺月时没有环比，返回 null 而不是 0
+                        if current_price and previous_price and consecutive:
+                            change_rate = round(((current_price - previous_price) / previous_price) * 100, 2)
                         else:
-                            change_rate = 0
+                            change_rate = None
                         
                         change_rate_results.append({
                             'city_name': city,
                             'year': data[i]['year'],
                             'month': data[i]['month'],
-                            'change_rate': round(change_rate, 2)
+                            'change_rate': change_rate
                         })
                 
                 return change_rate_results
@@ -155,23 +393,64 @@ def get_multi_city_monthly_change_rate_data(cities):
         print(f"获取城市月度涨跌幅数据错误: {e}")
         return []
     
-def get_ranking_race_data():
-    """获取所有城市的月度房价数据用于动态排名"""
+def get_ranking_race_data(conn=None, start=None, end=None):
+    """获取所有城市的月度房价数据用于动态排名，start / end 为 (year, month)"""
     try:
-        with get_db_connection() as conn:
+        with use_connection(conn) as conn:
             with conn.cursor() as cursor:
-                query = """
+                range_clause, range_params = month_range_clause(start, end)
+                query = f"""
                     SELECT city_name, year, month, price 
                     FROM monthly_price_for_all 
+                    WHERE 1 = 1{range_clause}
                     ORDER BY year, month, city_name
                 """
-                cursor.execute(query)
+                cursor.execute(query, range_params)
                 results = cursor.fetchall()
+
+                # 数据质量检查标记为不可用的数据不参与排名
+                masked = get_quality_mask('monthly_price_for_all', conn)
+                for row in results:
+                    if (row['city_name'], row['year'], row['month']) in masked:
+                        row['price'] = None
                 return results
     except Exception as e:
         print(f"获取排名竞速数据错误: {e}")
         return []
 
+def get_ranking_race_time_points(conn=None, after=None, end=None, limit=None):
+    """
+    按时间顺序获取排名竞速的时间点，用于分页
+
+    Args:
+        after: 游标 (year, month)，只返回其后的时间点
+        end: 结束时间 (year, month)
+        limit: 最多返回的时间点数量
+
+    Returns:
+        list: [(year, month), ...]
+    """
+    try:
+        with use_connection(conn) as conn:
+            with conn.cursor() as cursor:
+                query = "SELECT DISTINCT year, month FROM monthly_price_for_all WHERE 1 = 1"
+                params = []
+                if after:
+                    query += " AND (year, month) > (%s, %s)"
+                    params.extend(after)
+                if end:
+                    query += " AND (year, month) <= (%s, %s)"
+                    params.extend(end)
+                query += " ORDER BY year, month"
+                if limit:
+                    query += " LIMIT %s"
+                    params.append(limit)
+                cursor.execute(query, params)
+                return [(row['year'], row['month']) for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"获取排名竞速时间点错误: {e}")
+        return []
+
 # ============ 路由 ============
 
 @app.route('/')
@@ -182,25 +461,25 @@ def index():
 @app.route('/chart/price_compare')
 def price_page():
     """价格对比页面"""
-    cities = get_all_cities_monthly()
+    cities = get_page_cities('monthly')
     return render_template('price.html', cities=cities, current_page='price_compare')
 
 @app.route('/chart/monthly_change_rate_compare')
 def monthly_change_rate_page():
     """月度涨跌幅对比页面"""
-    cities = get_all_cities_monthly()
+    cities = get_page_cities('monthly')
     return render_template('monthly_change_rate.html', cities=cities, current_page='change_rate_compare')
 
 @app.route('/chart/yearly_change_rate_compare')
 def yearly_change_rate_page():
     """涨跌幅对比页面"""
-    cities = get_all_cities()
+    cities = get_page_cities('yearly')
     return render_template('yearly_change_rate.html', cities=cities, current_page='change_rate_compare')
 
 @app.route('/chart/ranking_race')
 def ranking_race_page():
     """城市房价排名竞速页面"""
-    cities = get_all_cities_monthly()
+    cities = get_page_cities('monthly')
     return render_template('ranking_race.html', cities=cities, current_page='ranking_race')
 
 @app.route('/map/price_map')
@@ -228,81 +507,654 @@ def map_view_redirect():
 
 # ============ API接口 ============
 
+# 相同请求并发到达时只查询/序列化一次
+request_flight = SingleFlight()
+
+# 接口数据缓存：条目记录生成时的数据版本，并保存预压缩的 gzip / br 字节
+payload_cache = PayloadCache(max_entries=256)
+
+def current_data_version():
+    """当前数据版本 token（确保后台版本监听已启动）"""
+    version_watcher.start()
+    return version_watcher.snapshot()['token']
+
+def data_stamp(depends_on=None):
+    """
+    缓存条目的版本戳
+
+    Args:
+        depends_on: [(表名, 城市名或 None), ...]，为空时依赖全部数据（使用数据版本 token）
+    """
+    if depends_on is None:
+        return version_token(current_versions())
+    return dependency_stamp(current_versions(), depends_on)
+
+def table_dependencies(table_name):
+    """依赖整张价格表的数据：价格表、该表的数据质量标记和城市维度"""
+    from quality import flag_version_name
+    return [(table_name, None), (flag_version_name(table_name), None), (DIM_TABLE, None)]
+
+def series_dependencies(table_name, cities):
+    """按城市取序列的数据只依赖这些城市：只导入其他城市时缓存仍然有效"""
+    from quality import flag_version_name
+    flags = flag_version_name(table_name)
+    return [(table_name, city) for city in cities] + [(flags, city) for city in cities] + [(DIM_TABLE, None)]
+
+def is_cacheable(payload):
+    """查询失败（数据库异常时查询函数返回空列表）的结果不缓存"""
+    if payload.get('success') is False or 'error' in payload:
+        return False
+    return all(is_cacheable(item['data']) for item in payload.get('results', []))
+
+def cached_payload(key, builder, depends_on=None):
+    """
+    返回缓存的接口数据（预压缩的 CompressedPayload）；未命中时合并相同的并发请求，
+    只查询、序列化、压缩一次，并共享结果字节。启动预热也通过它预填缓存
+
+    Args:
+        key: 规范化后的请求键，如 ('price_data', ('Beijing', 'Shanghai'))
+        builder: 生成响应字典的函数
+        depends_on: 所依赖的数据，见 data_stamp；只有这些数据更新后条目才失效
+    """
+    version = data_stamp(depends_on)
+    entry = payload_cache.get(key, version)
+
+    if entry is None:
+        def build():
+            payload = builder()
+            compressed = CompressedPayload(app.json.dumps(payload).encode('utf-8'), version)
+            if is_cacheable(payload):
+                payload_cache.put(key, compressed)
+            return compressed
+
+        entry, _ = request_flight.do(key + (version,), build)
+    return entry
+
+def coalesced_json(key, builder, depends_on=None):
+    """按请求的 Accept-Encoding 返回 cached_payload 的结果"""
+    entry = cached_payload(key, builder, depends_on)
+    body, encoding = entry.select(request.headers.get('Accept-Encoding'))
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def compress_dynamic_response(response):
+    """页面等没有预压缩的响应按需压缩"""
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
+def build_price_data(selected_cities, conn=None, start=None, end=None):
+    """组织房价月度图表数据"""
+    if not selected_cities:
+        return {
+            'dates': [],
+            'series': [],
+            'tableData': [],
+            'cities': []
+        }
+
+    data = get_multi_city_monthly_data(selected_cities, conn, start, end)
+
+    if not data:
+        return {
+            'dates': [],
+            'series': [],
+            'tableData': [],
+            'cities': selected_cities,
+            'error': '未找到数据'
+        }
+
+    # 组织数据
+    city_data = {}
+    dates = set()
+
+    for row in data:
+        city = row['city_name']
+        year = row['year']
+        month = row['month']
+        # 缺失或不可用的价格返回 null，图表上显示为断点而不是跌到 0
+        price = round(float(row['price']), 2) if row['price'] is not None else None
+
+        # 创建日期字符串 "YYYY-MM"
+        date_str = f"{year}-{month:02d}"
+        dates.add(date_str)
+
+        if city not in city_data:
+            city_data[city] = {}
+        city_data[city][date_str] = price
+
+    # 排序日期
+    dates = sorted(list(dates))
+
+    # 构建图表数据
+    series_data = []
+    for city in selected_cities:
+        prices = [city_data.get(city, {}).get(date) for date in dates]
+        series_data.append({
+            'name': city,
+            'type': 'line',
+            'data': prices,
+            'smooth': True,
+            'symbol': 'circle',
+            'symbolSize': 6
+        })
+
+    # 构建表格数据
+    table_data = []
+    for date in dates:
+        row = {'date': date}
+        for city in selected_cities:
+            row[city] = city_data.get(city, {}).get(date)
+        table_data.append(row)
+
+    return {
+        'dates': dates,
+        'series': series_data,
+        'tableData': table_data,
+        'cities': selected_cities,
+        'success': True
+    }
+
+def build_monthly_change_rate_data(selected_cities, conn=None, start=None, end=None):
+    """组织月度环比涨跌幅图表数据"""
+    if not selected_cities:
+        return {
+            'dates': [],
+            'series': [],
+            'tableData': [],
+            'cities': []
+        }
+
+    data = get_multi_city_monthly_change_rate_data(selected_cities, conn, start, end)
+
+    if not data:
+        return {
+            'dates': [],
+            'series': [],
+            'tableData': [],
+            'cities': selected_cities,
+            'error': '未找到数据'
+        }
+
+    # 组织数据
+    city_data = {}
+    dates = set()
+
+    for row in data:
+        city = row['city_name']
+        year = row['year']
+        month = row['month']
+        change_rate = round(float(row['change_rate']), 2) if row['change_rate'] is not None else None
+
+        # 创建日期字符串 "YYYY-MM"
+        date_str = f"{year}-{month:02d}"
+        dates.add(date_str)
+
+        if city not in city_data:
+            city_data[city] = {}
+        city_data[city][date_str] = change_rate
+
+    # 排序日期
+    dates = sorted(list(dates))
+
+    # 构建图表数据
+    series_data = []
+    for city in selected_cities:
+        rates = [city_data.get(city, {}).get(date) for date in dates]
+        series_data.append({
+            'name': city,
+            'type': 'line',
+            'data': rates,
+            'smooth': True,
+            'symbol': 'circle',
+            'symbolSize': 6,
+            'areaStyle': {
+                'opacity': 0.3
+            }
+        })
+
+    # 构建表格数据
+    table_data = []
+    for date in dates:
+        row = {'date': date}
+        for city in selected_cities:
+            row[city] = city_data.get(city, {}).get(date)
+        table_data.append(row)
+
+    return {
+        'dates': dates,
+        'series': series_data,
+        'tableData': table_data,
+        'cities': selected_cities,
+        'success': True
+    }
+
+def build_yearly_change_rate_data(selected_cities, conn=None, start=None, end=None):
+    """组织年度涨跌幅图表数据"""
+    if not selected_cities:
+        return {
+            'years': [],
+            'series': [],
+            'tableData': [],
+            'cities': []
+        }
+
+    data = get_multi_city_data(selected_cities, conn, start, end)
+
+    if not data:
+        return {
+            'years': [],
+            'series': [],
+            'tableData': [],
+            'cities': selected_cities,
+            'error': '未找到数据'
+        }
+
+    # 组织数据
+    city_data = {}
+    years = set()
+
+    for row in data:
+        city = row['city_name']
+        year = row['year']
+        change_rate = round(float(row['change_rate']), 2) if row['change_rate'] is not None else None
+
+        years.add(year)
+
+        if city not in city_data:
+            city_data[city] = {}
+        city_data[city][year] = change_rate
+
+    years = sorted(list(years))
+
+    # 构建图表数据
+    series_data = []
+    for city in selected_cities:
+        rates = [city_data.get(city, {}).get(year) for year in years]
+        series_data.append({
+            'name': city,
+            'type': 'line',
+            'data': rates,
+            'smooth': True,
+            'symbol': 'circle',
+            'symbolSize': 6,
+            'areaStyle': {
+                'opacity': 0.3
+            }
+        })
+
+    # 构建表格数据
+    table_data = []
+    for year in years:
+        row = {'year': year}
+        for city in selected_cities:
+            row[city] = city_data.get(city, {}).get(year)
+        table_data.append(row)
+
+    return {
+        'years': years,
+        'series': series_data,
+        'tableData': table_data,
+        'cities': selected_cities,
+        'success': True
+    }
+
+def build_ranking_race_data(conn=None, start=None, end=None, cursor=None, limit=None):
+    """
+    组织排名竞速数据：按时间点分组并按价格排序
+
+    传入 limit 时分页返回，cursor 为上一页最后一个时间点，
+    页面可以先播放第一页，同时在后台继续加载后面的帧
+    """
+    next_cursor = None
+    total_frames = None
+
+    if limit:
+        # 先确定本页包含哪些月份，再只查询这些月份的数据
+        after = cursor or (previous_month(start) if start else None)
+        page_points = get_ranking_race_time_points(conn, after=after, end=end, limit=limit + 1)
+        if len(page_points) > limit:
+            page_points = page_points[:limit]
+            next_cursor = f"{page_points[-1][0]}-{page_points[-1][1]:02d}"
+        if not page_points:
+            return {
+                'success': False,
+                'message': '没有有效的数据'
+            }
+        if cursor is None:
+            total_frames = len(get_ranking_race_time_points(conn, after=after, end=end))
+        raw_data = get_ranking_race_data(conn, page_points[0], page_points[-1])
+    else:
+        raw_data = get_ranking_race_data(conn, start, end)
+
+    if not raw_data:
+        return {
+            'success': False,
+            'message': '未找到数据'
+        }
+
+    # 按时间段分组数据
+    time_data = {}
+    time_points = set()
+    index = get_city_index()
+    display_names = {}
+    for name in {row['city_name'] for row in raw_data}:
+        city = index.resolve(name)
+        display_names[name] = city['display_name'] if city else name
+
+    for row in raw_data:
+        time_key = f"{row['year']}-{str(row['month']).zfill(2)}"
+        time_points.add(time_key)
+
+        if time_key not in time_data:
+            time_data[time_key] = []
+
+        price = float(row['price']) if row['price'] and row['price'] != '' else 0
+
+        # 确保价格有效
+        if price > 0:
+            time_data[time_key].append({
+                'city': row['city_name'],
+                'city_en': display_names.get(row['city_name'], row['city_name']),
+                'price': price
+            })
+
+    # 对每个时间段的数据按价格排序
+    for time_key in time_data:
+        time_data[time_key].sort(key=lambda x: x['price'], reverse=True)
+
+    # 获取所有时间点（排序）
+    time_points = sorted(list(time_points))
+
+    # 检查数据是否为空
+    if not time_points:
+        return {
+            'success': False,
+            'message': '没有有效的数据'
+        }
+
+    result = {
+        'success': True,
+        'timePoints': time_points,
+        'data': time_data
+    }
+    if limit:
+        result['nextCursor'] = next_cursor
+    if total_frames is not None:
+        result['totalFrames'] = total_frames
+    return result
+
+def build_map_data(year, conn=None):
+    """组织房价地图数据，year 为空时取最新年份"""
+    with use_connection(conn) as conn:
+        with conn.cursor() as cursor:
+            if not year:
+                cursor.execute("SELECT MAX(year) as max_year FROM yearly_price_for_all")
+                result = cursor.fetchone()
+                year = result['max_year']
+
+            query = """
+                SELECT city_name, year, price, change_rate 
+                FROM yearly_price_for_all 
+                WHERE year = %s AND price IS NOT NULL
+                ORDER BY price DESC
+            """
+            cursor.execute(query, (year,))
+            results = cursor.fetchall()
+
+            cursor.execute("SELECT DISTINCT year FROM yearly_price_for_all ORDER BY year")
+            years = [row['year'] for row in cursor.fetchall()]
+
+        masked = get_quality_mask('yearly_price_for_all', conn)
+
+    map_data = []
+    for row in results:
+        # 不可用的价格不上地图
+        if not valid_price(row, masked):
+            continue
+        map_data.append({
+            'name': row['city_name'],
+            'value': round(float(row['price']), 2),
+            'changeRate': round(float(row['change_rate']), 2) if row['change_rate'] is not None else None,
+            **city_info(row['city_name'])
+        })
+
+    return {
+        'success': True,
+        'year': year,
+        'years': years,
+        'data': map_data
+    }
+
+def build_change_rate_map_data(year, conn=None):
+    """组织涨跌幅地图数据，year 为空时取最新年份"""
+    with use_connection(conn) as conn:
+        with conn.cursor() as cursor:
+            if not year:
+                cursor.execute("SELECT MAX(year) as max_year FROM yearly_price_for_all")
+                result = cursor.fetchone()
+                year = result['max_year']
+
+            query = """
+                SELECT city_name, year, price, change_rate 
+                FROM yearly_price_for_all 
+                WHERE year = %s AND change_rate IS NOT NULL
+                ORDER BY change_rate DESC
+            """
+            cursor.execute(query, (year,))
+            results = cursor.fetchall()
+
+            cursor.execute("SELECT DISTINCT year FROM yearly_price_for_all ORDER BY year")
+            years = [row['year'] for row in cursor.fetchall()]
+
+        masked = get_quality_mask('yearly_price_for_all', conn)
+
+    map_data = []
+    for row in results:
+        # 当年价格不可用时涨跌幅也不可信
+        if (row['city_name'], row['year'], None) in masked:
+            continue
+        map_data.append({
+            'name': row['city_name'],
+            'value': round(float(row['change_rate']), 2),
+            'price': round(float(row['price']), 2) if row['price'] else None,
+            **city_info(row['city_name'])
+        })
+
+    return {
+        'success': True,
+        'year': year,
+        'years': years,
+        'data': map_data
+    }
+
+# 按数据版本缓存的派生结果（空间汇总、预测模型）：{键: (数据版本, 结果)}
+_derived = {}
+
+def derived_for_version(key, compute, depends_on=None):
+    """
+    当前数据版本的派生结果，每个版本只计算一次，并发请求合并为一次计算
+
+    Args:
+        key: 缓存键，如 ('rollup', 'yearly')
+        compute: 返回 (结果, 是否缓存) 的函数，查询失败得到的空结果不缓存
+        depends_on: 所依赖的数据，见 data_stamp
+    """
+    version = data_stamp(depends_on)
+    cached = _derived.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    def run():
+        result, cacheable = compute()
+        if cacheable:
+            _derived[key] = (version, result)
+        return result
+
+    result, _ = request_flight.do(('derived',) + key + (version,), run)
+    return result
+
+def get_price_rows(source, conn=None):
+    """全部价格数据（年度或月度），供汇总和预测使用；数据质量检查标记的行不参与"""
+    try:
+        with use_connection(conn) as conn:
+            with conn.cursor() as cursor:
+                if source == 'monthly':
+                    cursor.execute("""
+                        SELECT city_name, year, month, price
+                        FROM monthly_price_for_all
+                        WHERE price IS NOT NULL
+                    """)
+                    results = cursor.fetchall()
+                    masked = get_quality_mask('monthly_price_for_all', conn)
+                    return [(row['city_name'], row['year'], row['month'], float(row['price']))
+                            for row in results
+                            if (row['city_name'], row['year'], row['month']) not in masked]
+                cursor.execute("""
+                    SELECT city_name, year, price, change_rate
+                    FROM yearly_price_for_all
+                    WHERE price IS NOT NULL
+                """)
+                results = cursor.fetchall()
+                masked = get_quality_mask('yearly_price_for_all', conn)
+                return [(row['city_name'], row['year'], float(row['price']),
+                         float(row['change_rate']) if row['change_rate'] is not None else None)
+                        for row in results
+                        if (row['city_name'], row['year'], None) not in masked]
+    except Exception as e:
+        print(f"获取汇总数据错误: {e}")
+        return []
+
+def get_rollups(source, conn=None):
+    """当前数据版本的汇总结果"""
+    def compute():
+        from rollup import compute_rollups
+        rows = get_price_rows(source, conn)
+        return compute_rollups(rows, get_city_index(), source), bool(rows)
+
+    return derived_for_version(('rollup', source), compute, table_dependencies(f'{source}_price_for_all'))
+
+def get_forecast_models(conn=None):
+    """当前数据版本下所有城市的预测模型（批量拟合）"""
+    def compute():
+        from forecast import fit_rows
+        rows = get_price_rows('monthly', conn)
+        return fit_rows(rows), bool(rows)
+
+    return derived_for_version(('forecast_models',), compute, table_dependencies('monthly_price_for_all'))
+
+def get_quality_mask(table_name, conn=None):
+    """数据质量检查标记为不可用的 (city_name, year, month)，接口中按缺失值返回"""
+    def compute():
+        from quality import load_masked
+        try:
+            with use_connection(conn) as active:
+                return load_masked(active, table_name), True
+        except Exception as e:
+            print(f"获取数据质量标记错误: {e}")
+            return frozenset(), False
+
+    from quality import flag_version_name
+    return derived_for_version(('quality_mask', table_name), compute, [(flag_version_name(table_name), None)])
+
+def build_rollup_data(level, year=None, month=None, conn=None):
+    """
+    组织空间汇总数据
+
+    Args:
+        level: 'province' / 'region' / 'tier'
+        year: 年份，为空时取最新的时间点
+        month: 给出时按月度数据汇总，否则按年度数据
+    """
+    from rollup import period_key
+
+    source = 'monthly' if month else 'yearly'
+    by_period = get_rollups(source, conn)[level]
+    periods = sorted(by_period)
+    if not periods:
+        return {
+            'success': False,
+            'message': '未找到数据'
+        }
+
+    period = period_key(year, month) if year else periods[-1]
+
+    return {
+        'success': True,
+        'level': level,
+        'source': source,
+        'period': period,
+        'periods': periods,
+        'data': by_period.get(period, [])
+    }
+
+# 预测最多的月数
+FORECAST_MAX_HORIZON = 36
+
+def build_forecast_data(selected_cities, horizon=12, conn=None):
+    """组织房价预测数据：点预测及 80% / 95% 预测区间"""
+    from forecast import forecast
+
+    if not selected_cities:
+        return {
+            'dates': [],
+            'series': [],
+            'cities': []
+        }
+
+    models = get_forecast_models(conn)
+
+    series_data = []
+    skipped = []
+    dates = []
+    for city in selected_cities:
+        model = models.get(city)
+        if not model:
+            # 没有数据或数据太少，无法拟合
+            skipped.append(city)
+            continue
+        result = forecast(model, horizon)
+        dates = result.pop('dates')
+        series_data.append({
+            'name': city,
+            **result,
+            'params': {
+                'alpha': model['alpha'],
+                'beta': model['beta'],
+                'phi': model['phi']
+            },
+            'lastDate': f"{model['last_month'] // 12}-{model['last_month'] % 12 + 1:02d}"
+        })
+
+    if not series_data:
+        return {
+            'dates': [],
+            'series': [],
+            'cities': selected_cities,
+            'error': '未找到数据'
+        }
+
+    return {
+        'dates': dates,
+        'series': series_data,
+        'cities': selected_cities,
+        'skipped': skipped,
+        'horizon': horizon,
+        'success': True
+    }
+
 @app.route('/api/price_data', methods=['POST'])
 def get_price_data():
     """获取房价月度数据API"""
     try:
-        selected_cities = request.json.get('cities', [])
-        
-        if not selected_cities:
-            return jsonify({
-                'dates': [],
-                'series': [],
-                'tableData': [],
-                'cities': []
-            })
-        
-        selected_cities = selected_cities[:5]
-        data = get_multi_city_monthly_data(selected_cities)
-        
-        if not data:
-            return jsonify({
-                'dates': [],
-                'series': [],
-                'tableData': [],
-                'cities': selected_cities,
-                'error': '未找到数据'
-            })
-        
-        # 组织数据
-        city_data = {}
-        dates = set()
-        
-        for row in data:
-            city = row['city_name']
-            year = row['year']
-            month = row['month']
-            price = float(row['price']) if row['price'] is not None else 0
-            
-            # 创建日期字符串 "YYYY-MM"
-            date_str = f"{year}-{month:02d}"
-            dates.add(date_str)
-            
-            if city not in city_data:
-                city_data[city] = {}
-            city_data[city][date_str] = round(price, 2)
-        
-        # 排序日期
-        dates = sorted(list(dates))
-        
-        # 构建图表数据
-        series_data = []
-        for city in selected_cities:
-            prices = [city_data.get(city, {}).get(date, 0) for date in dates]
-            series_data.append({
-                'name': city,
-                'type': 'line',
-                'data': prices,
-                'smooth': True,
-                'symbol': 'circle',
-                'symbolSize': 6
-            })
-        
-        # 构建表格数据
-        table_data = []
-        for date in dates:
-            row = {'date': date}
-            for city in selected_cities:
-                row[city] = city_data.get(city, {}).get(date, 0)
-            table_data.append(row)
-        
-        return jsonify({
-            'dates': dates,
-            'series': series_data,
-            'tableData': table_data,
-            'cities': selected_cities,
-            'success': True
-        })
+        selected_cities = normalize_cities(request.json.get('cities', []))[:5]
+        start = parse_month(request.json.get('start'))
+        end = parse_month(request.json.get('end'), default_month=12)
+        return coalesced_json(('price_data', tuple(selected_cities), start, end),
+                              lambda: build_price_data(selected_cities, start=start, end=end),
+                              series_dependencies('monthly_price_for_all', selected_cities))
     
     except Exception as e:
         print(f"API错误 (price_data): {e}")
@@ -321,80 +1173,12 @@ def get_price_data():
 def get_monthly_change_rate_data():
     """获取涨跌幅月度数据API - 修改为月度环比"""
     try:
-        selected_cities = request.json.get('cities', [])
-        
-        if not selected_cities:
-            return jsonify({
-                'dates': [],
-                'series': [],
-                'tableData': [],
-                'cities': []
-            })
-        
-        selected_cities = selected_cities[:5]
-        data = get_multi_city_monthly_change_rate_data(selected_cities)
-        
-        if not data:
-            return jsonify({
-                'dates': [],
-                'series': [],
-                'tableData': [],
-                'cities': selected_cities,
-                'error': '未找到数据'
-            })
-        
-        # 组织数据
-        city_data = {}
-        dates = set()
-        
-        for row in data:
-            city = row['city_name']
-            year = row['year']
-            month = row['month']
-            change_rate = float(row['change_rate']) if row['change_rate'] is not None else 0
-            
-            # 创建日期字符串 "YYYY-MM"
-            date_str = f"{year}-{month:02d}"
-            dates.add(date_str)
-            
-            if city not in city_data:
-                city_data[city] = {}
-            city_data[city][date_str] = round(change_rate, 2)
-        
-        # 排序日期
-        dates = sorted(list(dates))
-        
-        # 构建图表数据
-        series_data = []
-        for city in selected_cities:
-            rates = [city_data.get(city, {}).get(date, 0) for date in dates]
-            series_data.append({
-                'name': city,
-                'type': 'line',
-                'data': rates,
-                'smooth': True,
-                'symbol': 'circle',
-                'symbolSize': 6,
-                'areaStyle': {
-                    'opacity': 0.3
-                }
-            })
-        
-        # 构建表格数据
-        table_data = []
-        for date in dates:
-            row = {'date': date}
-            for city in selected_cities:
-                row[city] = city_data.get(city, {}).get(date, 0)
-            table_data.append(row)
-        
-        return jsonify({
-            'dates': dates,
-            'series': series_data,
-            'tableData': table_data,
-            'cities': selected_cities,
-            'success': True
-        })
+        selected_cities = normalize_cities(request.json.get('cities', []))[:5]
+        start = parse_month(request.json.get('start'))
+        end = parse_month(request.json.get('end'), default_month=12)
+        return coalesced_json(('monthly_change_rate_data', tuple(selected_cities), start, end),
+                              lambda: build_monthly_change_rate_data(selected_cities, start=start, end=end),
+                              series_dependencies('monthly_price_for_all', selected_cities))
     
     except Exception as e:
         print(f"API错误 (change_rate_data): {e}")
@@ -413,76 +1197,12 @@ def get_monthly_change_rate_data():
 def get_yearly_change_rate_data():
     """获取涨跌幅数据API"""
     try:
-        selected_cities = request.json.get('cities', [])
-        
-        if not selected_cities:
-            return jsonify({
-                'years': [],
-                'series': [],
-                'tableData': [],
-                'cities': []
-            })
-        
-        selected_cities = selected_cities[:5]
-        data = get_multi_city_data(selected_cities)
-        
-        if not data:
-            return jsonify({
-                'years': [],
-                'series': [],
-                'tableData': [],
-                'cities': selected_cities,
-                'error': '未找到数据'
-            })
-        
-        # 组织数据
-        city_data = {}
-        years = set()
-        
-        for row in data:
-            city = row['city_name']
-            year = row['year']
-            change_rate = float(row['change_rate']) if row['change_rate'] is not None else 0
-            
-            years.add(year)
-            
-            if city not in city_data:
-                city_data[city] = {}
-            city_data[city][year] = round(change_rate, 2)
-        
-        years = sorted(list(years))
-        
-        # 构建图表数据
-        series_data = []
-        for city in selected_cities:
-            rates = [city_data.get(city, {}).get(year, 0) for year in years]
-            series_data.append({
-                'name': city,
-                'type': 'line',
-                'data': rates,
-                'smooth': True,
-                'symbol': 'circle',
-                'symbolSize': 6,
-                'areaStyle': {
-                    'opacity': 0.3
-                }
-            })
-        
-        # 构建表格数据
-        table_data = []
-        for year in years:
-            row = {'year': year}
-            for city in selected_cities:
-                row[city] = city_data.get(city, {}).get(year, 0)
-            table_data.append(row)
-        
-        return jsonify({
-            'years': years,
-            'series': series_data,
-            'tableData': table_data,
-            'cities': selected_cities,
-            'success': True
-        })
+        selected_cities = normalize_cities(request.json.get('cities', []))[:5]
+        start = parse_month(request.json.get('start'))
+        end = parse_month(request.json.get('end'), default_month=12)
+        return coalesced_json(('yearly_change_rate_data', tuple(selected_cities), start, end),
+                              lambda: build_yearly_change_rate_data(selected_cities, start=start, end=end),
+                              series_dependencies('yearly_price_for_all', selected_cities))
     
     except Exception as e:
         print(f"API错误 (change_rate_data): {e}")
@@ -497,58 +1217,22 @@ def get_yearly_change_rate_data():
             'cities': []
         }), 500
 
+# 排名竞速分页时每页最多的时间点数
+RANKING_RACE_MAX_PAGE = 120
+
 @app.route('/api/ranking_race_data')
 def get_ranking_race_api():
-    """获取排名竞速数据API"""
+    """获取排名竞速数据API - 支持 start/end 时间范围和 cursor/limit 分页"""
     try:
-        raw_data = get_ranking_race_data()
-        
-        if not raw_data:
-            return jsonify({
-                'success': False,
-                'message': '未找到数据'
-            })
-        
-        # 按时间段分组数据
-        time_data = {}
-        time_points = set()
-        
-        for row in raw_data:
-            time_key = f"{row['year']}-{str(row['month']).zfill(2)}"
-            time_points.add(time_key)
-            
-            if time_key not in time_data:
-                time_data[time_key] = []
-            
-            price = float(row['price']) if row['price'] and row['price'] != '' else 0
-            
-            # 确保价格有效
-            if price > 0:
-                time_data[time_key].append({
-                    'city': row['city_name'],
-                    'city_en': row['city_name'],  # 如果没有英文名，使用中文名
-                    'price': price
-                })
-        
-        # 对每个时间段的数据按价格排序
-        for time_key in time_data:
-            time_data[time_key].sort(key=lambda x: x['price'], reverse=True)
-        
-        # 获取所有时间点（排序）
-        time_points = sorted(list(time_points))
-        
-        # 检查数据是否为空
-        if not time_points:
-            return jsonify({
-                'success': False,
-                'message': '没有有效的数据'
-            })
-        
-        return jsonify({
-            'success': True,
-            'timePoints': time_points,
-            'data': time_data
-        })
+        start = parse_month(request.args.get('start'))
+        end = parse_month(request.args.get('end'), default_month=12)
+        cursor = parse_month(request.args.get('cursor'))
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, RANKING_RACE_MAX_PAGE))
+        return coalesced_json(('ranking_race_data', start, end, cursor, limit),
+                              lambda: build_ranking_race_data(start=start, end=end, cursor=cursor, limit=limit),
+                              table_dependencies('monthly_price_for_all'))
         
     except Exception as e:
         print(f"获取排名竞速数据API错误: {e}")
@@ -564,40 +1248,8 @@ def get_map_data():
     """获取地图数据API - 获取所有城市的最新房价"""
     try:
         year = request.args.get('year', type=int)
-        
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                if not year:
-                    cursor.execute("SELECT MAX(year) as max_year FROM yearly_price_for_all")
-                    result = cursor.fetchone()
-                    year = result['max_year']
-                
-                query = """
-                    SELECT city_name, price, change_rate 
-                    FROM yearly_price_for_all 
-                    WHERE year = %s AND price IS NOT NULL
-                    ORDER BY price DESC
-                """
-                cursor.execute(query, (year,))
-                results = cursor.fetchall()
-                
-                cursor.execute("SELECT DISTINCT year FROM yearly_price_for_all ORDER BY year")
-                years = [row['year'] for row in cursor.fetchall()]
-                
-                map_data = []
-                for row in results:
-                    map_data.append({
-                        'name': row['city_name'],
-                        'value': round(float(row['price']), 2) if row['price'] else 0,
-                        'changeRate': round(float(row['change_rate']), 2) if row['change_rate'] else 0
-                    })
-                
-                return jsonify({
-                    'success': True,
-                    'year': year,
-                    'years': years,
-                    'data': map_data
-                })
+        return coalesced_json(('map_data', year), lambda: build_map_data(year),
+                              table_dependencies('yearly_price_for_all'))
     
     except Exception as e:
         print(f"API错误 (map_data): {e}")
@@ -613,40 +1265,8 @@ def get_change_rate_map_data():
     """获取涨跌幅地图数据API"""
     try:
         year = request.args.get('year', type=int)
-        
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                if not year:
-                    cursor.execute("SELECT MAX(year) as max_year FROM yearly_price_for_all")
-                    result = cursor.fetchone()
-                    year = result['max_year']
-                
-                query = """
-                    SELECT city_name, price, change_rate 
-                    FROM yearly_price_for_all 
-                    WHERE year = %s AND change_rate IS NOT NULL
-                    ORDER BY change_rate DESC
-                """
-                cursor.execute(query, (year,))
-                results = cursor.fetchall()
-                
-                cursor.execute("SELECT DISTINCT year FROM yearly_price_for_all ORDER BY year")
-                years = [row['year'] for row in cursor.fetchall()]
-                
-                map_data = []
-                for row in results:
-                    map_data.append({
-                        'name': row['city_name'],
-                        'value': round(float(row['change_rate']), 2) if row['change_rate'] else 0,
-                        'price': round(float(row['price']), 2) if row['price'] else 0
-                    })
-                
-                return jsonify({
-                    'success': True,
-                    'year': year,
-                    'years': years,
-                    'data': map_data
-                })
+        return coalesced_json(('change_rate_map_data', year), lambda: build_change_rate_map_data(year),
+                              table_dependencies('yearly_price_for_all'))
     
     except Exception as e:
         print(f"API错误 (change_rate_map_data): {e}")
@@ -657,21 +1277,364 @@ def get_change_rate_map_data():
             'success': False
         }), 500
 
-if __name__ == '__main__':
-    # 测试数据库连接
+@app.route('/api/rollup_data', methods=['GET'])
+def get_rollup_data():
+    """获取空间汇总数据API（按省份 / 区域 / 城市等级聚合）"""
+    from rollup import LEVELS as ROLLUP_LEVELS
+
     try:
-        with get_db_connection() as conn:
-            print("✅ 数据库连接成功！")
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(DISTINCT city_name) as count FROM yearly_price_for_all")
-                result = cursor.fetchone()
-                print(f"✅ 年度数据表找到 {result['count']} 个城市")
-                
-                cursor.execute("SELECT COUNT(DISTINCT city_name) as count FROM monthly_price_for_all")
-                result = cursor.fetchone()
-                print(f"✅ 月度数据表找到 {result['count']} 个城市")
+        level = request.args.get('level', 'province')
+        if level not in ROLLUP_LEVELS:
+            return jsonify({
+                'error': f'未知的汇总层级: {level}',
+                'success': False
+            }), 400
+        year = request.args.get('year', type=int)
+        month = request.args.get('month', type=int)
+        if month is not None and not 1 <= month <= 12:
+            month = None
+        return coalesced_json(('rollup_data', level, year, month), lambda: build_rollup_data(level, year, month),
+                              table_dependencies('monthly_price_for_all' if month else 'yearly_price_for_all'))
+    
     except Exception as e:
-        print(f"❌ 数据库连接失败: {e}")
-        print("请检查数据库配置是否正确")
+        print(f"API错误 (rollup_data): {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 500
+
+@app.route('/api/forecast', methods=['POST'])
+def get_forecast_data():
+    """获取房价预测数据API"""
+    try:
+        selected_cities = normalize_cities(request.json.get('cities', []))[:5]
+        horizon = max(1, min(int(request.json.get('horizon') or 12), FORECAST_MAX_HORIZON))
+        # 预测起点取整个面板的最后一个月，任一城市的新数据都可能改变它，按整表失效
+        return coalesced_json(('forecast', tuple(selected_cities), horizon),
+                              lambda: build_forecast_data(selected_cities, horizon),
+                              table_dependencies('monthly_price_for_all'))
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    except Exception as e:
+        print(f"API错误 (forecast): {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'success': False,
+            'dates': [],
+            'series': [],
+            'cities': []
+        }), 500
+
+# 单次批量请求最多包含的子查询数
+BATCH_MAX_QUERIES = 20
+
+def run_batch_query(query, conn):
+    """
+    在给定连接上执行一个批量子查询
+
+    Args:
+        query: 子查询，如 {'type': 'price', 'cities': [...], 'start': '2018-01'} 或 {'type': 'map', 'year': 2020}
+        conn: 批量请求共享的快照连接
+    """
+    query_type = query.get('type')
+    cities = normalize_cities(query.get('cities') or [])[:5]
+    year = query.get('year')
+    start = parse_month(query.get('start'))
+    end = parse_month(query.get('end'), default_month=12)
+
+    if query_type == 'cities':
+        if query.get('source') == 'yearly':
+            return {'success': True, 'cities': get_all_cities(conn)}
+        return {'success': True, 'cities': get_all_cities_monthly(conn)}
+    if query_type == 'price':
+        return build_price_data(cities, conn, start, end)
+    if query_type == 'monthly_change_rate':
+        return build_monthly_change_rate_data(cities, conn, start, end)
+    if query_type == 'yearly_change_rate':
+        return build_yearly_change_rate_data(cities, conn, start, end)
+    if query_type == 'map':
+        return build_map_data(year, conn)
+    if query_type == 'change_rate_map':
+        return build_change_rate_map_data(year, conn)
+    if query_type == 'forecast':
+        horizon = max(1, min(int(query.get('horizon') or 12), FORECAST_MAX_HORIZON))
+        return build_forecast_data(cities, horizon, conn)
+    if query_type == 'rollup':
+        from rollup import LEVELS as ROLLUP_LEVELS
+        level = query.get('level', 'province')
+        if level not in ROLLUP_LEVELS:
+            return {'success': False, 'error': f'未知的汇总层级: {level}'}
+        return build_rollup_data(level, year, query.get('month'), conn)
+    if query_type == 'ranking_race':
+        limit = query.get('limit')
+        if limit is not None:
+            limit = max(1, min(int(limit), RANKING_RACE_MAX_PAGE))
+        return build_ranking_race_data(conn, start, end, parse_month(query.get('cursor')), limit)
+
+    return {'success': False, 'error': f'未知的查询类型: {query_type}'}
+
+def batch_dependencies(queries):
+    """
+    批量请求所依赖的数据：各子查询对应单独接口的缓存依赖之和
+
+    Returns:
+        list: [(表名, 城市名或 None), ...]；含未知类型的子查询时为 None（依赖全部数据）
+    """
+    depends_on = []
+    for query in queries:
+        query_type = query.get('type')
+        if query_type in ('price', 'monthly_change_rate', 'yearly_change_rate'):
+            table_name = 'yearly_price_for_all' if query_type == 'yearly_change_rate' else 'monthly_price_for_all'
+            cities = normalize_cities(query.get('cities') or [])[:5]
+            deps = series_dependencies(table_name, cities)
+        elif query_type == 'cities':
+            deps = [('yearly_price_for_all' if query.get('source') == 'yearly' else 'monthly_price_for_all', None)]
+        elif query_type in ('map', 'change_rate_map'):
+            deps = table_dependencies('yearly_price_for_all')
+        elif query_type == 'rollup':
+            deps = table_dependencies('monthly_price_for_all' if query.get('month') else 'yearly_price_for_all')
+        elif query_type in ('forecast', 'ranking_race'):
+            deps = table_dependencies('monthly_price_for_all')
+        else:
+            return None
+        depends_on.extend(dep for dep in deps if dep not in depends_on)
+    return depends_on
+
+def build_batch_data(queries):
+    """在同一个一致性快照中依次执行所有子查询，派生数据也按快照中的版本查找"""
+    results = []
+    with get_snapshot_connection() as conn:
+        versions = fetch_versions(conn)
+        with snapshot_scope(conn, versions):
+            for index, query in enumerate(queries):
+                try:
+                    data = run_batch_query(query, conn)
+                except Exception as e:
+                    print(f"批量子查询错误 ({query.get('type')}): {e}")
+                    data = {'success': False, 'error': str(e)}
+                results.append({
+                    'id': query.get('id', index),
+                    'type': query.get('type'),
+                    'data': data
+                })
+
+    return {
+        'success': True,
+        'version': version_token(versions),
+        'results': results
+    }
+
+@app.route('/api/batch', methods=['POST'])
+def get_batch_data():
+    """批量查询API - 一次请求返回多个图表的数据，所有子查询看到同一版本的数据"""
+    try:
+        queries = request.json.get('queries', [])
+
+        if not isinstance(queries, list) or not all(isinstance(q, dict) for q in queries):
+            return jsonify({'success': False, 'error': 'queries 必须是对象列表'}), 400
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({'success': False, 'error': f'最多支持 {BATCH_MAX_QUERIES} 个子查询'}), 400
+
+        key = json.dumps(queries, sort_keys=True, ensure_ascii=False)
+        return coalesced_json(('batch', key), lambda: build_batch_data(queries), batch_dependencies(queries))
+
+    except Exception as e:
+        print(f"API错误 (batch): {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'success': False,
+            'results': []
+        }), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行指标API - 请求合并与缓存统计"""
+    return jsonify({
+        'success': True,
+        'singleflight': request_flight.metrics(),
+        'cache': payload_cache.metrics(),
+        'warmup': warmup.status(),
+        'storage': db_backend.describe()
+    })
+
+# ============ 数据更新推送 ============
+
+SSE_HEARTBEAT_SECONDS = 20
+LONG_POLL_SECONDS = 25
+
+@app.route('/api/events')
+def data_events():
+    """数据版本推送（SSE）- 导入新数据后通知所有打开的页面"""
+    # 浏览器自动重连时带 Last-Event-ID，手动重连时带 since
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    subscription = version_watcher.subscribe()
+    current = version_watcher.snapshot()
+
+    def stream():
+        try:
+            # 重连间隔加随机抖动，服务重启后客户端不会同时涌入
+            yield f"retry: {retry_with_jitter()}\n\n"
+            yield format_sse(json.dumps({'token': current['token']}), event='hello', event_id=current['token'])
+
+            # 断线期间错过的更新
+            missed = version_watcher.changes_since(since) if since else None
+            if missed and missed['changed']:
+                yield format_sse(json.dumps(missed), event='data_version', event_id=missed['token'])
+
+            while True:
+                try:
+                    event = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # 心跳，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(json.dumps(event), event='data_version', event_id=event['token'])
+        finally:
+            version_watcher.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/data_version', methods=['GET'])
+def get_data_version():
+    """数据版本查询 / 长轮询API（不支持 EventSource 的客户端使用）"""
+    since = request.args.get('since')
+    wait = min(request.args.get('wait', default=0, type=int), LONG_POLL_SECONDS)
+    current = version_watcher.snapshot()
+
+    if since is None:
+        return jsonify({
+            'success': True,
+            'token': current['token'],
+            'tables': current['tables'],
+            'changed': {}
+        })
+
+    if wait > 0:
+        event = version_watcher.wait_for_change(since, wait)
+    else:
+        event = version_watcher.changes_since(since)
+
+    return jsonify({
+        'success': True,
+        'token': event['token'] if event else since,
+        'changed': event['changed'] if event else {}
+    })
+
+# ============ 启动预热 ============
+
+# 服务先开始监听，预热任务按顺序在后台线程执行；预热期间请求照常处理（数据按需加载）
+warmup = Warmup()
+
+# 与 ranking_race.html 中的 PAGE_SIZE 一致，预热页面首次请求的那一页
+RANKING_RACE_WARM_PAGE = 24
+
+@warmup.task('imports')
+def warm_imports():
+    """导入 NumPy 及依赖它的模块"""
+    import forecast, quality, rollup  # noqa: F401
+
+@warmup.task('database')
+def warm_database():
+    """测试数据库连接并读取数据版本"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(DISTINCT city_name) as count FROM yearly_price_for_all")
+            yearly = cursor.fetchone()['count']
+            cursor.execute("SELECT COUNT(DISTINCT city_name) as count FROM monthly_price_for_all")
+            monthly = cursor.fetchone()['count']
+    print(f"✅ 数据库连接成功，年度数据 {yearly} 个城市，月度数据 {monthly} 个城市")
+    current_data_version()
+
+@warmup.task('cities')
+def warm_cities():
+    """城市维度索引和页面城市列表"""
+    get_city_index()
+    get_page_cities('monthly')
+    get_page_cities('yearly')
+
+@warmup.task('quality')
+def warm_quality():
+    for table_name in ('monthly_price_for_all', 'yearly_price_for_all'):
+        get_quality_mask(table_name)
+
+@warmup.task('maps')
+def warm_maps():
+    """最新年份的房价 / 涨跌幅地图（序列化并压缩后放入接口缓存）"""
+    depends_on = table_dependencies('yearly_price_for_all')
+    cached_payload(('map_data', None), lambda: build_map_data(None), depends_on)
+    cached_payload(('change_rate_map_data', None), lambda: build_change_rate_map_data(None), depends_on)
+
+@warmup.task('ranking_race')
+def warm_ranking_race():
+    """排名竞速的首页时间帧和完整数据"""
+    depends_on = table_dependencies('monthly_price_for_all')
+    cached_payload(('ranking_race_data', None, None, None, RANKING_RACE_WARM_PAGE),
+                   lambda: build_ranking_race_data(limit=RANKING_RACE_WARM_PAGE), depends_on)
+    cached_payload(('ranking_race_data', None, None, None, None), lambda: build_ranking_race_data(), depends_on)
+
+@warmup.task('rollups')
+def warm_rollups():
+    get_rollups('yearly')
+    get_rollups('monthly')
+
+@warmup.task('forecast')
+def warm_forecast():
+    get_forecast_models()
+
+def start_warmup():
+    """
+    启动后台预热
+
+    直接运行 app.py 时自动调用；用 gunicorn 等多 worker 部署时在 worker 启动钩子中调用，
+    如 post_worker_init = lambda worker: __import__('app').start_warmup()
+    """
+    warmup.start()
+
+@app.after_request
+def record_first_byte(response):
+    """记录第一个业务响应距进程启动的时间（健康检查和推送连接不算）"""
+    if request.endpoint not in (None, 'static', 'get_health', 'data_events', 'get_data_version'):
+        warmup.mark_first_byte()
+    return response
+
+@app.route('/api/health', methods=['GET'])
+def get_health():
+    """健康检查API - 预热中返回 503 和 warming，完成后返回 200"""
+    status = warmup.status()
+    return jsonify({'success': True, **status}), 503 if status['status'] == 'warming' else 200
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="房价可视化服务")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--no-warmup', action='store_true', help="不做启动预热，数据在首次请求时加载")
+    parser.add_argument('--no-debug', action='store_true', help="关闭调试模式和自动重载（测量启动耗时时使用）")
+    parser.add_argument('--storage', choices=['mysql', 'sqlite'], help="存储后端，默认取 STORAGE_CONFIG")
+    parser.add_argument('--sqlite-path', help="SQLite 数据库文件，不存在或比 CSV 旧时自动生成")
+    parser.add_argument('--read-only', action='store_true', help="SQLite 只读不可变模式（数据库需事先生成）")
+    args = parser.parse_args()
+
+    if args.storage:
+        STORAGE_CONFIG['backend'] = args.storage
+    if args.sqlite_path:
+        STORAGE_CONFIG['sqlite_path'] = args.sqlite_path
+    if args.read_only:
+        STORAGE_CONFIG['read_only'] = True
+    db_backend = create_backend(STORAGE_CONFIG, DB_CONFIG)
+    print(f"ℹ️  存储后端: {db_backend.describe()}")
+
+    # 调试模式下 reloader 的父进程只监视文件，预热放在实际提供服务的子进程里
+    if not args.no_warmup and (args.no_debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_warmup()
+
+    app.run(debug=not args.no_debug, host=args.host, port=args.port)
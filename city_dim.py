@@ -0,0 +1,454 @@
+# 城市维度表：为每个城市分配固定的整数ID，记录中文名、省份、坐标和各种别名（拼音、中文、错拼），
+# 导入时用它统一城市名并写入 city_id，查询时先在内存哈希索引里把城市名换成ID再按整数查询
+import argparse
+import threading
+
+DIM_TABLE = 'city_dim'
+ALIAS_TABLE = 'city_alias'
+PRICE_TABLES = {
+    # 表名: city_id 索引包含的列
+    'monthly_price_for_all': 'city_id, year, month',
+    'yearly_price_for_all': 'city_id, year',
+}
+
+# 后来增加的维度列
+DIM_EXTRA_COLUMNS = {'region': 'VARCHAR(32) NULL', 'tier': 'VARCHAR(32) NULL', 'population': 'INT NULL'}
+
+# 数据库中新出现的城市从该ID开始分配，参考数据的ID固定不变
+DYNAMIC_ID_START = 1000
+
+# 参考数据：(ID, 英文名, 显示名, 中文名, 省份, 省份英文, 是否省会/直辖市/特别行政区, 纬度, 经度, 其他别名)
+# 英文名与数据表中的 city_name 一致；省会城市在地图上代表所在省份；区域、等级和人口见后面的表
+CITY_REFERENCE = [
+    (1, 'Beijing', 'Beijing', '北京', '北京市', 'Beijing', True, 39.90, 116.41, ['Peking']),
+    (2, 'Changchun', 'Changchun', '长春', '吉林省', 'Jilin', True, 43.82, 125.32, []),
+    (3, 'Changsha', 'Changsha', '长沙', '湖南省', 'Hunan', True, 28.23, 112.94, []),
+    (4, 'Chengdu', 'Chengdu', '成都', '四川省', 'Sichuan', True, 30.57, 104.07, []),
+    (5, 'Chongqing', 'Chongqing', '重庆', '重庆市', 'Chongqing', True, 29.56, 106.55, ['Chungking']),
+    (6, 'Fuzhou', 'Fuzhou', '福州', '福建省', 'Fujian', True, 26.07, 119.30, []),
+    (7, 'Guangzhou', 'Guangzhou', '广州', '广东省', 'Guangdong', True, 23.13, 113.26, ['Canton']),
+    (8, 'Guiyang', 'Guiyang', '贵阳', '贵州省', 'Guizhou', True, 26.65, 106.63, []),
+    (9, 'Haikou', 'Haikou', '海口', '海南省', 'Hainan', True, 20.04, 110.20, []),
+    (10, 'Hangzhou', 'Hangzhou', '杭州', '浙江省', 'Zhejiang', True, 30.27, 120.16, []),
+    (11, 'Harbin', 'Harbin', '哈尔滨', '黑龙江省', 'Heilongjiang', True, 45.80, 126.53, ['Haerbin']),
+    (12, 'Hefei', 'Hefei', '合肥', '安徽省', 'Anhui', True, 31.82, 117.23, []),
+    (13, 'Hohhot', 'Hohhot', '呼和浩特', '内蒙古自治区', 'Inner Mongolia', True, 40.84, 111.75, ['Huhehaote']),
+    (14, 'Hong Kong', 'Hong Kong', '香港', '香港特别行政区', 'Hong Kong', True, 22.32, 114.17, ['Hongkong', 'Xianggang']),
+    (15, 'Jinan', 'Jinan', '济南', '山东省', 'Shandong', True, 36.65, 117.12, []),
+    (16, 'Kunming', 'Kunming', '昆明', '云南省', 'Yunnan', True, 25.04, 102.71, []),
+    (17, 'Lanzhou', 'Lanzhou', '兰州', '甘肃省', 'Gansu', True, 36.06, 103.83, []),
+    (18, 'Lhasa', 'Lhasa', '拉萨', '西藏自治区', 'Tibet', True, 29.65, 91.13, ['Lasa']),
+    (19, 'Macao', 'Macao', '澳门', '澳门特别行政区', 'Macao', True, 22.20, 113.54, ['Macau', 'Aomen']),
+    (20, 'Nanchang', 'Nanchang', '南昌', '江西省', 'Jiangxi', True, 28.68, 115.86, []),
+    (21, 'Nanjing', 'Nanjing', '南京', '江苏省', 'Jiangsu', True, 32.06, 118.80, ['Nanking']),
+    (22, 'Nanning', 'Nanning', '南宁', '广西壮族自治区', 'Guangxi', True, 22.82, 108.37, []),
+    (23, 'Shanghai', 'Shanghai', '上海', '上海市', 'Shanghai', True, 31.23, 121.47, []),
+    (24, 'Shenyang', 'Shenyang', '沈阳', '辽宁省', 'Liaoning', True, 41.81, 123.43, []),
+    (25, 'Shenzhen', 'Shenzhen', '深圳', '广东省', 'Guangdong', False, 22.54, 114.06, ['Shenzheng']),
+    (26, 'Shijiazhuang', 'Shijiazhuang', '石家庄', '河北省', 'Hebei', True, 38.04, 114.51, []),
+    (27, 'Suzhou', 'Suzhou', '苏州', '江苏省', 'Jiangsu', False, 31.30, 120.58, []),
+    (28, 'Taiwan', 'Taiwan', '台湾', '台湾省', 'Taiwan', True, 25.03, 121.56, ['Taipei']),
+    (29, 'Taiyuan', 'Taiyuan', '太原', '山西省', 'Shanxi', True, 37.87, 112.55, []),
+    (30, 'Tianjin', 'Tianjin', '天津', '天津市', 'Tianjin', True, 39.34, 117.36, []),
+    (31, 'Urumchi', 'Urumqi', '乌鲁木齐', '新疆维吾尔自治区', 'Xinjiang', True, 43.83, 87.62, ['Urumqi', 'Wulumuqi']),
+    (32, 'Wuhan', 'Wuhan', '武汉', '湖北省', 'Hubei', True, 30.59, 114.31, []),
+    (33, "Xi'an", "Xi'an", '西安', '陕西省', 'Shaanxi', True, 34.34, 108.94, ['Xian', 'Sian']),
+    (34, 'Xiamen', 'Xiamen', '厦门', '福建省', 'Fujian', False, 24.48, 118.09, ['Amoy']),
+    (35, 'Xining', 'Xining', '西宁', '青海省', 'Qinghai', True, 36.62, 101.78, []),
+    (36, 'Yinchuan', 'Yinchuan', '银川', '宁夏回族自治区', 'Ningxia', True, 38.49, 106.23, []),
+    (37, 'Zhengzhou', 'Zhengzhou', '郑州', '河南省', 'Henan', True, 34.75, 113.63, []),
+]
+
+
+# 东中西部划分（国家统计局口径），港澳台单独成组
+PROVINCE_REGIONS = {
+    'East': ['Beijing', 'Tianjin', 'Hebei', 'Liaoning', 'Shanghai', 'Jiangsu', 'Zhejiang',
+             'Fujian', 'Shandong', 'Guangdong', 'Hainan'],
+    'Central': ['Shanxi', 'Jilin', 'Heilongjiang', 'Anhui', 'Jiangxi', 'Henan', 'Hubei', 'Hunan'],
+    'West': ['Inner Mongolia', 'Guangxi', 'Chongqing', 'Sichuan', 'Guizhou', 'Yunnan', 'Tibet',
+             'Shaanxi', 'Gansu', 'Qinghai', 'Ningxia', 'Xinjiang'],
+    'HK/Macao/Taiwan': ['Hong Kong', 'Macao', 'Taiwan'],
+}
+PROVINCE_TO_REGION = {province: region for region, provinces in PROVINCE_REGIONS.items() for province in provinces}
+
+# 城市等级
+CITY_TIERS = {
+    'Tier 1': ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen'],
+    'New Tier 1': ['Chengdu', 'Chongqing', 'Hangzhou', 'Wuhan', "Xi'an", 'Suzhou', 'Tianjin',
+                   'Nanjing', 'Changsha', 'Zhengzhou', 'Hefei'],
+    'Tier 2': ['Kunming', 'Shenyang', 'Jinan', 'Xiamen', 'Fuzhou', 'Harbin', 'Changchun',
+               'Shijiazhuang', 'Nanning', 'Nanchang', 'Guiyang', 'Taiyuan', 'Lanzhou'],
+    'Tier 3': ['Haikou', 'Hohhot', 'Urumchi', 'Yinchuan', 'Xining', 'Lhasa'],
+    'HK/Macao/Taiwan': ['Hong Kong', 'Macao', 'Taiwan'],
+}
+CITY_TO_TIER = {city: tier for tier, cities in CITY_TIERS.items() for city in cities}
+
+# 常住人口（万人，约为2020年人口普查数，台湾取台北市），用作汇总时的权重
+CITY_POPULATION = {
+    'Beijing': 2189, 'Changchun': 907, 'Changsha': 1005, 'Chengdu': 2094, 'Chongqing': 3205,
+    'Fuzhou': 829, 'Guangzhou': 1868, 'Guiyang': 599, 'Haikou': 287, 'Hangzhou': 1194,
+    'Harbin': 1001, 'Hefei': 937, 'Hohhot': 345, 'Hong Kong': 747, 'Jinan': 920,
+    'Kunming': 846, 'Lanzhou': 436, 'Lhasa': 87, 'Macao': 68, 'Nanchang': 626,
+    'Nanjing': 931, 'Nanning': 874, 'Shanghai': 2487, 'Shenyang': 907, 'Shenzhen': 1756,
+    'Shijiazhuang': 1064, 'Suzhou': 1275, 'Taiwan': 260, 'Taiyuan': 531, 'Tianjin': 1387,
+    'Urumchi': 405, 'Wuhan': 1232, "Xi'an": 1296, 'Xiamen': 516, 'Xining': 247,
+    'Yinchuan': 286, 'Zhengzhou': 1260,
+}
+
+
+def alias_key(name):
+    """别名归一化：忽略大小写、空格、撇号、连字符以及中文名末尾的"市"字"""
+    if name is None:
+        return ''
+    key = str(name).strip().lower()
+    for char in (' ', "'", '’', '-', '_'):
+        key = key.replace(char, '')
+    if key.endswith('市') and len(key) > 2:
+        key = key[:-1]
+    return key
+
+
+class CityIndex:
+    """城市别名 → 城市的哈希索引"""
+
+    def __init__(self, cities=()):
+        self.cities = {}
+        self._aliases = {}
+        for city in cities:
+            self.add(city)
+
+    def add(self, city, aliases=()):
+        """
+        Args:
+            city: 城市字典，至少包含 city_id 与 city_name
+            aliases: 额外别名
+        """
+        self.cities[city['city_id']] = city
+        names = [city['city_name'], city.get('display_name'), city.get('name_zh')]
+        names += list(city.get('aliases', [])) + list(aliases)
+        for name in names:
+            key = alias_key(name)
+            if key:
+                self._aliases.setdefault(key, city['city_id'])
+
+    def add_alias(self, alias, city_id):
+        """给已有城市增加别名，已被占用的别名保持原来的城市"""
+        key = alias_key(alias)
+        if key and city_id in self.cities:
+            self._aliases.setdefault(key, city_id)
+
+    def resolve(self, name):
+        """按任意别名查找城市，找不到返回 None"""
+        city_id = self._aliases.get(alias_key(name))
+        return self.cities.get(city_id) if city_id is not None else None
+
+    def id_of(self, name):
+        city = self.resolve(name)
+        return city['city_id'] if city else None
+
+    def ids_of(self, names):
+        """批量换成ID，忽略无法识别的城市名"""
+        ids = []
+        for name in names:
+            city_id = self.id_of(name)
+            if city_id is not None:
+                ids.append(city_id)
+        return ids
+
+    def canonical_name(self, name):
+        """统一后的城市名；不认识的城市只整理空白和大小写"""
+        city = self.resolve(name)
+        if city:
+            return city['city_name']
+        words = str(name).split()
+        return ' '.join(word[:1].upper() + word[1:].lower() for word in words) or None
+
+    def by_id(self, city_id):
+        return self.cities.get(city_id)
+
+    def next_id(self):
+        return max([DYNAMIC_ID_START - 1] + [city_id for city_id in self.cities if city_id >= DYNAMIC_ID_START]) + 1
+
+
+def reference_cities():
+    """参考数据转换为城市字典列表"""
+    return [
+        {
+            'city_id': city_id,
+            'city_name': name,
+            'display_name': display_name,
+            'name_zh': name_zh,
+            'province': province,
+            'province_en': province_en,
+            'is_capital': is_capital,
+            'lat': lat,
+            'lon': lon,
+            'region': PROVINCE_TO_REGION.get(province_en),
+            'tier': CITY_TO_TIER.get(name),
+            'population': CITY_POPULATION.get(name),
+            'aliases': aliases
+        }
+        for city_id, name, display_name, name_zh, province, province_en, is_capital, lat, lon, aliases in CITY_REFERENCE
+    ]
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def default_index():
+    """只包含参考数据的索引（进程内共享）"""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = CityIndex(reference_cities())
+        return _default_index
+
+
+def ensure_city_tables(conn):
+    """创建城市维度表和别名表"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {DIM_TABLE} (
+                city_id INT NOT NULL PRIMARY KEY,
+                city_name VARCHAR(64) NOT NULL UNIQUE,
+                display_name VARCHAR(64) NOT NULL,
+                name_zh VARCHAR(32) NULL,
+                province VARCHAR(32) NULL,
+                province_en VARCHAR(64) NULL,
+                is_capital TINYINT NOT NULL DEFAULT 0,
+                lat DOUBLE NULL,
+                lon DOUBLE NULL,
+                region VARCHAR(32) NULL,
+                tier VARCHAR(32) NULL,
+                population INT NULL
+            )
+        """)
+        # 早期版本的维度表没有区域、等级和人口列
+        for column, definition in DIM_EXTRA_COLUMNS.items():
+            cursor.execute(f"SHOW COLUMNS FROM {DIM_TABLE} LIKE %s", (column,))
+            if not cursor.fetchone():
+                cursor.execute(f"ALTER TABLE {DIM_TABLE} ADD COLUMN {column} {definition}")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {ALIAS_TABLE} (
+                alias VARCHAR(64) NOT NULL PRIMARY KEY,
+                city_id INT NOT NULL,
+                INDEX idx_city_alias_city (city_id)
+            )
+        """)
+    conn.commit()
+
+
+def _fetch_dicts(cursor):
+    """兼容 DictCursor 与普通游标（pandas / SQLAlchemy 的原始连接返回元组）"""
+    columns = [column[0] for column in cursor.description]
+    return [row if isinstance(row, dict) else dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def load_index(conn):
+    """参考数据 + 数据库中登记过的其他城市，以及别名表中保存的别名"""
+    index = CityIndex(reference_cities())
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW TABLES LIKE %s", (DIM_TABLE,))
+        if not cursor.fetchone():
+            return index
+        cursor.execute(f"""
+            SELECT city_id, city_name, display_name, name_zh, province, province_en, is_capital, lat, lon,
+                   region, tier, population
+            FROM {DIM_TABLE} WHERE city_id >= %s
+        """, (DYNAMIC_ID_START,))
+        for city in _fetch_dicts(cursor):
+            city['is_capital'] = bool(city['is_capital'])
+            index.add(city)
+
+        # 登记新城市时记下的原始写法、手工补充的别名等；与参考数据冲突时以参考数据为准
+        cursor.execute("SHOW TABLES LIKE %s", (ALIAS_TABLE,))
+        if cursor.fetchone():
+            cursor.execute(f"SELECT alias, city_id FROM {ALIAS_TABLE}")
+            for row in _fetch_dicts(cursor):
+                index.add_alias(row['alias'], row['city_id'])
+    return index
+
+
+def register_city(conn, index, name):
+    """
+    登记参考数据里没有的城市，分配新ID
+
+    Returns:
+        dict: 城市字典
+    """
+    city = index.resolve(name)
+    if city:
+        return city
+
+    city = {
+        'city_id': index.next_id(),
+        'city_name': index.canonical_name(name),
+        'display_name': index.canonical_name(name),
+        'name_zh': None,
+        'province': None,
+        'province_en': None,
+        'is_capital': False,
+        'lat': None,
+        'lon': None,
+        'region': None,
+        'tier': None,
+        'population': None
+    }
+    _upsert_cities(conn, [city])
+    index.add(city, aliases=[name])
+    _upsert_aliases(conn, [(alias_key(name), city['city_id'])])
+    print(f"ℹ️  新城市已登记: {city['city_name']} (city_id={city['city_id']})")
+    return city
+
+
+def register_cities(conn, names, index=None):
+    """
+    导入时批量解析城市名，参考数据里没有的城市登记新ID
+
+    Args:
+        names: 城市名（任意别名写法）
+        index: 复用的索引（调用方需已建好维度表），为空时从数据库加载
+
+    Returns:
+        dict: {原始城市名: 城市字典}
+    """
+    from data_version import bump_version
+
+    if index is None:
+        ensure_city_tables(conn)
+        index = load_index(conn)
+
+    resolved = {}
+    registered = 0
+    for name in set(names):
+        if name is None:
+            continue
+        city = index.resolve(name)
+        if city is None:
+            city = register_city(conn, index, name)
+            registered += 1
+        resolved[name] = city
+    conn.commit()
+
+    if registered:
+        # 通知各进程重新加载城市索引
+        bump_version(conn, DIM_TABLE, rows=len(index.cities))
+    return resolved
+
+
+def _upsert_cities(conn, cities):
+    with conn.cursor() as cursor:
+        cursor.executemany(f"""
+            INSERT INTO {DIM_TABLE} (city_id, city_name, display_name, name_zh, province, province_en, is_capital,
+                                     lat, lon, region, tier, population)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                city_name = VALUES(city_name), display_name = VALUES(display_name), name_zh = VALUES(name_zh),
+                province = VALUES(province), province_en = VALUES(province_en), is_capital = VALUES(is_capital),
+                lat = VALUES(lat), lon = VALUES(lon), region = VALUES(region), tier = VALUES(tier),
+                population = VALUES(population)
+        """, [
+            (c['city_id'], c['city_name'], c['display_name'], c['name_zh'], c['province'],
+             c['province_en'], int(c['is_capital']), c['lat'], c['lon'], c['region'], c['tier'], c['population'])
+            for c in cities
+        ])
+
+
+def _upsert_aliases(conn, pairs):
+    with conn.cursor() as cursor:
+        cursor.executemany(f"""
+            INSERT INTO {ALIAS_TABLE} (alias, city_id) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE city_id = VALUES(city_id)
+        """, pairs)
+
+
+def ensure_city_columns(conn, table_name):
+    """价格表增加 city_id 列及 (city_id, 时间) 索引"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'city_id'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN city_id INT NULL")
+        cursor.execute(f"SHOW INDEX FROM {table_name} WHERE Key_name = 'idx_city_id_time'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_city_id_time ({PRICE_TABLES[table_name]})")
+    conn.commit()
+
+
+def sync_city_dim(conn, tables=None):
+    """
+    同步维度表并回填价格表的 city_id：
+    写入参考数据和别名 → 登记价格表里出现的新城市 → 统一城市名拼写 → 回填 city_id
+
+    Args:
+        tables: 要处理的价格表，默认全部
+
+    Returns:
+        CityIndex: 同步后的索引
+    """
+    from data_version import bump_version
+
+    ensure_city_tables(conn)
+    index = load_index(conn)
+
+    cities = list(index.cities.values())
+    _upsert_cities(conn, cities)
+    _upsert_aliases(conn, [(key, city_id) for key, city_id in index._aliases.items()])
+    conn.commit()
+
+    for table_name in tables or PRICE_TABLES:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            if not cursor.fetchone():
+                continue
+        ensure_city_columns(conn, table_name)
+
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT city_name, city_id FROM {table_name}")
+            rows = _fetch_dicts(cursor)
+
+        renamed = set()
+        with conn.cursor() as cursor:
+            for row in rows:
+                name = row['city_name']
+                if name is None:
+                    continue
+                city = register_city(conn, index, name)
+                if name != city['city_name'] or row['city_id'] != city['city_id']:
+                    cursor.execute(f"UPDATE {table_name} SET city_name = %s, city_id = %s WHERE city_name = %s",
+                                   (city['city_name'], city['city_id'], name))
+                    renamed.add(city['city_name'])
+        conn.commit()
+
+        if renamed:
+            print(f"✅ {table_name}: 更新了 {len(renamed)} 个城市的名称/ID")
+            bump_version(conn, table_name, cities=renamed)
+
+    bump_version(conn, DIM_TABLE, rows=len(index.cities))
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="城市维度表")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('sync', help="写入维度表并回填价格表的 city_id")
+    lookup = subparsers.add_parser('lookup', help="查询城市别名")
+    lookup.add_argument('names', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'lookup':
+        index = default_index()
+        for name in args.names:
+            city = index.resolve(name)
+            print(f"{name} → {city['city_id']} {city['city_name']} ({city['name_zh']}, {city['province']})"
+                  if city else f"{name} → 未知城市")
+        return
+
+    from storage import open_connection
+    with open_connection() as conn:
+        index = sync_city_dim(conn)
+    print(f"✅ 城市维度表已同步，共 {len(index.cities)} 个城市")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# 响应压缩：可缓存的接口数据只在生成时压缩一次，压缩结果和缓存条目放在一起；
+# 页面等动态响应在 after_request 中按需压缩
+import gzip
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益抵不过CPU和头部开销）
+MIN_COMPRESS_SIZE = 1024
+
+# 缓存条目的预压缩级别：只压缩一次所以比动态压缩更高，
+# 但 br-11 压缩整份排名竞速数据要约 400ms，会拖慢缓存未命中的请求，因此取 8
+PRECOMPRESS_LEVELS = {'gzip': 9, 'br': 8}
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain'
+}
+
+
+def supported_encodings():
+    """服务端支持的编码，按优先级排列"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    根据 Accept-Encoding 选择压缩编码
+
+    Args:
+        accept_encoding: 请求头字符串，如 'gzip, deflate, br;q=0.9'
+
+    Returns:
+        str: 'br' / 'gzip'，客户端不支持时返回 None
+    """
+    qualities = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def compress(data, encoding, level=None):
+    """按指定编码压缩字节串，level 为空时使用适合动态响应的中等级别"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if level is None else level)
+    if encoding == 'gzip':
+        # mtime=0 保证同样的内容压缩结果一致
+        return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+    return data
+
+
+class CompressedPayload:
+    """序列化后的响应体及其预压缩版本"""
+
+    def __init__(self, body, version=None, min_size=MIN_COMPRESS_SIZE):
+        """
+        Args:
+            body: 未压缩的响应字节
+            version: 生成时的数据版本，用于判断缓存是否过期
+            min_size: 压缩阈值
+        """
+        self.body = body
+        self.version = version
+        self.encoded = {}
+        if len(body) >= min_size:
+            # 只在生成时压缩一次，命中缓存时直接复用
+            for encoding in supported_encodings():
+                self.encoded[encoding] = compress(body, encoding, level=PRECOMPRESS_LEVELS[encoding])
+
+    def select(self, accept_encoding):
+        """
+        按客户端支持的编码选择响应体
+
+        Returns:
+            tuple: (响应字节, Content-Encoding 或 None)
+        """
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding in self.encoded:
+            return self.encoded[encoding], encoding
+        return self.body, None
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+class PayloadCache:
+    """
+    按请求键缓存 CompressedPayload，LRU 淘汰
+
+    条目的 version 是生成时所依赖数据的版本戳，与当前版本戳不同时失效
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                if entry is not None:
+                    # 依赖的数据更新过
+                    self.stale += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry.size for entry in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale
+            }
+
+
+def compress_response(response, accept_encoding, min_size=MIN_COMPRESS_SIZE):
+    """
+    动态压缩 Flask 响应（after_request 中调用）
+
+    已压缩、流式（SSE）、文件直传、非文本或过小的响应保持原样
+    """
+    if (response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    data = response.get_data()
+    response.vary.add('Accept-Encoding')
+    if len(data) < min_size:
+        return response
+
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def benchmark(samples, repeat=20):
+    """
+    对比各编码/级别的压缩耗时与节省的字节数
+
+    Args:
+        samples: {名称: 字节串}
+        repeat: 每种组合重复次数
+    """
+    options = [('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        options += [('br', 5), ('br', 8), ('br', 11)]
+
+    print(f"{'payload':28s} {'raw KB':>8s} {'codec':>8s} {'out KB':>8s} {'saved':>7s} {'ms/op':>8s}")
+    print("-" * 72)
+    for name, data in samples.items():
+        for encoding, level in options:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                out = compress(data, encoding, level)
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            saved = 1 - len(out) / len(data)
+            print(f"{name:28s} {len(data) / 1024:8.1f} {encoding + '-' + str(level):>8s} "
+                  f"{len(out) / 1024:8.1f} {saved:7.1%} {elapsed:8.2f}")
+
+
+if __name__ == "__main__":
+    # 用仓库内的数据构造与接口返回体相近的样本
+    import csv
+    import json
+    import os
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    frames = {}
+    with open(os.path.join(base_dir, 'data', 'monthly_price.csv'), encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            key = f"{row['year']}-{int(row['month']):02d}"
+            frames.setdefault(key, []).append({
+                'city': row['city_name'],
+                'city_en': row['city_name'],
+                'price': float(row['price'])
+            })
+    race_payload = json.dumps({'success': True, 'timePoints': sorted(frames), 'data': frames}).encode('utf-8')
+
+    samples = {'ranking_race_data (full)': race_payload}
+    for template in ['price.html', 'change_rate_map.html']:
+        with open(os.path.join(base_dir, 'templates', template), 'rb') as f:
+            samples[template] = f.read()
+
+    benchmark(samples)
@@ -0,0 +1,515 @@
+# 爬取任务调度：基于本地 SQLite 的持久化任务队列
+# 每个 (city_code, year) 是一个任务，worker 以租约方式领取，
+# 进程崩溃后租约过期会被其他 worker 重新领取，已完成的任务不会重复爬取。
+# 使用 --sink db 时结果同时流式写入 MySQL，synced 标记该任务的数据是否已入库
+import argparse
+import csv
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+DEFAULT_QUEUE_PATH = './data/crawl_queue.db'
+
+# 任务状态
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_jobs (
+    city_code TEXT NOT NULL,
+    city_name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    row_count INTEGER,
+    synced INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (city_code, year)
+);
+CREATE INDEX IF NOT EXISTS idx_crawl_jobs_claim ON crawl_jobs (state, priority DESC, not_before);
+
+CREATE TABLE IF NOT EXISTS crawl_results (
+    city_code TEXT NOT NULL,
+    city_name TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    price INTEGER NOT NULL,
+    PRIMARY KEY (city_code, year, month)
+);
+"""
+
+
+def connect(path=DEFAULT_QUEUE_PATH):
+    """打开队列数据库（WAL 模式，允许多个 worker 进程并发读写）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript(SCHEMA)
+
+    # 旧版本创建的队列没有 synced 列
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(crawl_jobs)")}
+    if 'synced' not in columns:
+        conn.execute("ALTER TABLE crawl_jobs ADD COLUMN synced INTEGER NOT NULL DEFAULT 0")
+    return conn
+
+
+def in_shard(city_code, shard):
+    """
+    按城市代号分片，多台机器各自只处理自己的分片
+
+    Args:
+        shard: (index, count)，如 (0, 3) 表示三台机器中的第一台；None 表示不分片
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(str(city_code).encode('utf-8')) % count == index
+
+
+def enqueue_jobs(conn, cities, start_year, end_year, priority=0, max_attempts=3, shard=None):
+    """
+    批量添加任务，已存在的任务保持原状态（已完成的不会重新排队）
+
+    Args:
+        cities: {'城市代号': '城市名称'}
+        shard: 分片 (index, count)
+
+    Returns:
+        int: 新增的任务数
+    """
+    now = time.time()
+    jobs = [
+        (code, name, year, priority, max_attempts, now)
+        for code, name in cities.items() if in_shard(code, shard)
+        for year in range(start_year, end_year + 1)
+    ]
+    before = conn.total_changes
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("""
+        INSERT OR IGNORE INTO crawl_jobs (city_code, city_name, year, priority, max_attempts, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, jobs)
+    conn.execute("COMMIT")
+    return conn.total_changes - before
+
+
+def claim_job(conn, worker_id, lease_seconds=120):
+    """
+    领取一个任务：优先级高的先领，租约过期的运行中任务视为可重新领取
+
+    Returns:
+        sqlite3.Row 或 None（暂无可领取的任务）
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        job = conn.execute("""
+            SELECT city_code, city_name, year, attempts, max_attempts
+            FROM crawl_jobs
+            WHERE (state = 'pending' AND not_before <= ?)
+               OR (state = 'running' AND lease_until < ?)
+            ORDER BY priority DESC, year, city_code
+            LIMIT 1
+        """, (now, now)).fetchone()
+
+        if job is None:
+            conn.execute("COMMIT")
+            return None
+
+        conn.execute("""
+            UPDATE crawl_jobs
+            SET state = 'running', lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+            WHERE city_code = ? AND year = ?
+        """, (worker_id, now + lease_seconds, now, job['city_code'], job['year']))
+        conn.execute("COMMIT")
+        return job
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def renew_lease(conn, worker_id, job, lease_seconds=120):
+    """
+    延长本 worker 持有的租约
+
+    Returns:
+        bool: 租约已过期并被其他 worker 接管时返回 False
+    """
+    now = time.time()
+    cursor = conn.execute("""
+        UPDATE crawl_jobs SET lease_until = ?, updated_at = ?
+        WHERE city_code = ? AND year = ? AND state = 'running' AND lease_owner = ?
+    """, (now + lease_seconds, now, job['city_code'], job['year'], worker_id))
+    return cursor.rowcount > 0
+
+
+@contextmanager
+def lease_heartbeat(queue_path, worker_id, job, lease_seconds=120):
+    """
+    爬取期间每隔 1/3 租约时长续租一次，请求再慢任务也不会被其他 worker 重复领取；
+    worker 进程崩溃时续租随之停止，租约照常过期
+
+    SQLite 连接不能跨线程使用，续租线程单独打开队列连接
+    """
+    stop = threading.Event()
+
+    def beat():
+        conn = connect(queue_path)
+        try:
+            while not stop.wait(lease_seconds / 3):
+                if not renew_lease(conn, worker_id, job, lease_seconds):
+                    break
+        except Exception as e:
+            print(f"⚠️  [{worker_id}] 续租失败: {e}")
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=beat, name='lease-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def complete_job(conn, worker_id, job, rows):
+    """
+    标记任务完成并保存结果（同一事务，崩溃时不会出现"已完成但没有数据"）
+
+    Returns:
+        bool: 租约已被其他 worker 接管时返回 False，结果丢弃
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute("""
+            UPDATE crawl_jobs
+            SET state = 'done', lease_owner = NULL, lease_until = NULL, row_count = ?, last_error = NULL, updated_at = ?
+            WHERE city_code = ? AND year = ? AND state = 'running' AND lease_owner = ?
+        """, (len(rows), time.time(), job['city_code'], job['year'], worker_id))
+        if cursor.rowcount == 0:
+            conn.execute("ROLLBACK")
+            return False
+
+        conn.executemany("""
+            INSERT OR REPLACE INTO crawl_results (city_code, city_name, year, month, price)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(job['city_code'], city_name, year, month, price) for city_name, year, month, price in rows])
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def fail_job(conn, worker_id, job, error, backoff_seconds=30):
+    """任务失败：未超过重试次数时按指数退避重新排队，否则标记为失败"""
+    now = time.time()
+    retry_at = now + backoff_seconds * (2 ** (job['attempts']))
+    conn.execute("""
+        UPDATE crawl_jobs
+        SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+            not_before = ?, lease_owner = NULL, lease_until = NULL, last_error = ?, updated_at = ?
+        WHERE city_code = ? AND year = ? AND state = 'running' AND lease_owner = ?
+    """, (retry_at, str(error)[:500], now, job['city_code'], job['year'], worker_id))
+
+
+def expire_exhausted(conn):
+    """租约过期且已用完重试次数的任务（多次导致 worker 崩溃）标记为失败"""
+    cursor = conn.execute("""
+        UPDATE crawl_jobs
+        SET state = 'failed', lease_owner = NULL, lease_until = NULL,
+            last_error = COALESCE(last_error, 'lease expired'), updated_at = ?
+        WHERE state = 'running' AND lease_until < ? AND attempts >= max_attempts
+    """, (time.time(), time.time()))
+    return cursor.rowcount
+
+
+def retry_failed(conn):
+    """把失败的任务重新放回队列"""
+    cursor = conn.execute("""
+        UPDATE crawl_jobs
+        SET state = 'pending', attempts = 0, not_before = 0, updated_at = ?
+        WHERE state = 'failed'
+    """, (time.time(),))
+    return cursor.rowcount
+
+
+def mark_synced(conn, keys):
+    """标记任务结果已写入数据库，keys 为 [(city_code, year), ...]"""
+    conn.executemany("UPDATE crawl_jobs SET synced = 1 WHERE city_code = ? AND year = ?", keys)
+
+
+def unsynced_results(conn):
+    """
+    已完成但结果尚未写入数据库的任务（写库失败或进程崩溃时遗留）
+
+    Returns:
+        dict: {(city_code, year): [(city_name, year, month, price), ...]}
+    """
+    rows = conn.execute("""
+        SELECT r.city_code, r.city_name, r.year, r.month, r.price
+        FROM crawl_results r
+        JOIN crawl_jobs j ON j.city_code = r.city_code AND j.year = r.year
+        WHERE j.state = 'done' AND j.synced = 0
+        ORDER BY r.city_code, r.year, r.month
+    """).fetchall()
+
+    results = {}
+    for row in rows:
+        results.setdefault((row['city_code'], row['year']), []).append(
+            (row['city_name'], row['year'], row['month'], row['price']))
+    return results
+
+
+def open_db_sink(queue_path):
+    """
+    创建写入数据库的 PriceSink（存储后端按环境变量选择），写入成功后在队列中标记 synced
+
+    SQLite 连接不能跨线程使用，回调在写入线程里单独打开队列连接
+    """
+    from crawl_sink import PriceSink
+    from storage import open_connection
+
+    local = {}
+
+    def on_flushed(keys):
+        if 'conn' not in local:
+            local['conn'] = connect(queue_path)
+        mark_synced(local['conn'], keys)
+
+    return PriceSink(open_connection, on_flushed=on_flushed)
+
+
+def sync_to_db(conn, queue_path):
+    """把未入库的结果重新写入数据库（upsert，可重复执行）"""
+    pending = unsynced_results(conn)
+    if not pending:
+        return 0
+
+    sink = open_db_sink(queue_path)
+    try:
+        for key, rows in pending.items():
+            sink.write(rows, key=key)
+    finally:
+        sink.close()
+    return len(pending)
+
+
+def queue_status(conn):
+    """各状态的任务数"""
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    for row in conn.execute("SELECT state, COUNT(*) AS count FROM crawl_jobs GROUP BY state"):
+        counts[row['state']] = row['count']
+    return counts
+
+
+def has_unfinished(conn):
+    row = conn.execute("SELECT COUNT(*) AS count FROM crawl_jobs WHERE state IN ('pending', 'running')").fetchone()
+    return row['count'] > 0
+
+
+def run_worker(queue_path=DEFAULT_QUEUE_PATH, worker_id=None, base_url=None, lease_seconds=120,
+               delay=1.0, retry_backoff=30, idle_exit=True, sink=None):
+    """
+    worker 主循环：领取任务 → 爬取 → 保存结果，直到队列清空
+
+    Args:
+        worker_id: worker 标识，默认使用 主机名:进程号
+        lease_seconds: 任务租约时长（秒），爬取期间后台线程定期续租
+        base_url: 站点地址，为空时使用 worm.BASE_URL
+        delay: 两次请求之间的间隔（秒），避免请求过快
+        retry_backoff: 失败重试的基础退避时间（秒）
+        idle_exit: 队列中没有待处理任务时退出；为 False 时持续等待新任务
+        sink: 'db' 时结果同时流式写入 MySQL，数据库写入跟不上时 worker 会被阻塞
+    """
+    from worm import get_house_price, BASE_URL, CrawlError
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    conn = connect(queue_path)
+    db_sink = open_db_sink(queue_path) if sink == 'db' else None
+    processed = 0
+
+    try:
+        while True:
+            expire_exhausted(conn)
+            job = claim_job(conn, worker_id, lease_seconds)
+
+            if job is None:
+                if idle_exit and not has_unfinished(conn):
+                    break
+                # 其余任务在退避等待或被其他 worker 持有
+                time.sleep(min(delay * 5, 10))
+                continue
+
+            try:
+                with lease_heartbeat(queue_path, worker_id, job, lease_seconds):
+                    rows = get_house_price(job['city_code'], job['city_name'], job['year'],
+                                           base_url=base_url or BASE_URL, raise_errors=True)
+            except CrawlError as e:
+                fail_job(conn, worker_id, job, e, retry_backoff)
+            else:
+                if not complete_job(conn, worker_id, job, rows):
+                    print(f"⚠️  [{worker_id}] {job['city_name']} {job['year']}年 - 租约已过期，结果丢弃")
+                elif db_sink is not None:
+                    db_sink.write(rows, key=(job['city_code'], job['year']))
+                processed += 1
+
+            time.sleep(delay)
+    finally:
+        if db_sink is not None:
+            db_sink.close()
+            print(f"💾 [{worker_id}] 已写入数据库 {db_sink.stats['rows']} 行，"
+                  f"因写库背压等待 {db_sink.stats['blocked_seconds']:.1f} 秒")
+        conn.close()
+
+    print(f"✅ [{worker_id}] 队列已清空，本 worker 完成 {processed} 个任务")
+    return processed
+
+
+def run_workers(count, **kwargs):
+    """启动多个 worker 进程并等待全部结束"""
+    processes = [
+        multiprocessing.Process(target=run_worker, kwargs=kwargs, name=f"crawl-worker-{i}")
+        for i in range(count)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def export_csv(conn, output_dir):
+    """
+    按城市导出爬取结果，格式与 worm.py 相同（无表头），可直接交给 merge.py 合并
+
+    Returns:
+        int: 导出的文件数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rows = conn.execute("""
+        SELECT city_name, year, month, price FROM crawl_results
+        ORDER BY city_name, year, month
+    """).fetchall()
+
+    by_city = {}
+    for row in rows:
+        by_city.setdefault(row['city_name'], []).append(tuple(row))
+
+    for city_name, city_rows in by_city.items():
+        filepath = os.path.join(output_dir, f"{city_name.lower()}_house_price.csv")
+        with open(filepath, 'w', newline='', encoding='utf-8-sig') as f:
+            csv.writer(f).writerows(city_rows)
+        print(f"💾 {city_name} 数据已保存到: {filepath}")
+
+    return len(by_city)
+
+
+def parse_cities(value):
+    """解析 '108:Nanning,2:Shanghai' 形式的城市列表"""
+    cities = {}
+    for item in value.split(','):
+        code, _, name = item.strip().partition(':')
+        if code and name:
+            cities[code] = name
+    return cities
+
+
+def parse_shard(value):
+    """解析 '0/3' 形式的分片参数"""
+    if not value:
+        return None
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"无效的分片: {value}")
+    return (index, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房价爬取任务队列")
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help="队列数据库路径")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = subparsers.add_parser('enqueue', help="添加爬取任务")
+    enqueue.add_argument('--cities', help="城市列表，如 108:Nanning,2:Shanghai；默认使用 worm.DEFAULT_CITIES")
+    enqueue.add_argument('--start', type=int, default=2015, help="起始年份")
+    enqueue.add_argument('--end', type=int, default=2024, help="结束年份")
+    enqueue.add_argument('--priority', type=int, default=0, help="优先级，数值大的先爬")
+    enqueue.add_argument('--max-attempts', type=int, default=3, help="最大尝试次数")
+    enqueue.add_argument('--shard', type=parse_shard, help="只添加属于该分片的城市，如 0/3")
+
+    work = subparsers.add_parser('work', help="启动 worker 处理任务")
+    work.add_argument('--workers', type=int, default=1, help="worker 进程数")
+    work.add_argument('--lease', type=int, default=120, help="任务租约时长（秒）")
+    work.add_argument('--delay', type=float, default=1.0, help="请求间隔（秒）")
+    work.add_argument('--retry-backoff', type=float, default=30, help="失败重试的基础退避时间（秒）")
+    work.add_argument('--base-url', help="站点地址，测试时可指向本地桩服务器")
+    work.add_argument('--forever', action='store_true', help="队列清空后继续等待新任务")
+    work.add_argument('--sink', choices=['db'], help="db: 结果直接写入 monthly_price_for_all")
+
+    subparsers.add_parser('status', help="查看任务状态")
+    subparsers.add_parser('retry-failed', help="重新排队失败的任务")
+    subparsers.add_parser('sync-db', help="把尚未入库的结果写入数据库")
+
+    export = subparsers.add_parser('export', help="按城市导出CSV（供 merge.py 合并）")
+    export.add_argument('--output-dir', default='./data/csv_data', help="输出目录")
+
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        if args.sink == 'db':
+            # 先补写上次遗留的未入库结果
+            conn = connect(args.queue)
+            try:
+                sync_to_db(conn, args.queue)
+            finally:
+                conn.close()
+        run_workers(args.workers, queue_path=args.queue, base_url=args.base_url,
+                    lease_seconds=args.lease, delay=args.delay, retry_backoff=args.retry_backoff,
+                    idle_exit=not args.forever, sink=args.sink)
+        return
+
+    conn = connect(args.queue)
+    try:
+        if args.command == 'enqueue':
+            if args.cities:
+                cities = parse_cities(args.cities)
+            else:
+                from worm import DEFAULT_CITIES
+                cities = DEFAULT_CITIES
+            added = enqueue_jobs(conn, cities, args.start, args.end, args.priority, args.max_attempts, args.shard)
+            print(f"✅ 新增 {added} 个任务")
+        elif args.command == 'retry-failed':
+            print(f"✅ {retry_failed(conn)} 个失败任务已重新排队")
+        elif args.command == 'sync-db':
+            print(f"✅ {sync_to_db(conn, args.queue)} 个任务的结果已写入数据库")
+        elif args.command == 'export':
+            print(f"✅ 共导出 {export_csv(conn, args.output_dir)} 个城市")
+
+        counts = queue_status(conn)
+        print("📊 任务状态: " + ", ".join(f"{state} {count}" for state, count in counts.items()))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# 爬虫直写数据库：爬取结果进入有界队列，由后台线程攒批后 upsert 到 monthly_price_for_all，
+# 队列满时 write() 阻塞，爬虫自动放慢到数据库能承受的速度（背压）
+import queue
+import threading
+import time
+
+from city_dim import ensure_city_columns, ensure_city_tables, load_index, register_cities
+from data_version import bump_version
+from quality import run_quality_pass
+
+PRICE_TABLE = 'monthly_price_for_all'
+UNIQUE_KEY_NAME = 'uk_city_month'
+
+_STOP = object()
+
+
+def ensure_price_table(conn, table_name=PRICE_TABLE):
+    """
+    确保价格表存在且有 (city_name, year, month) 唯一键，upsert 依赖该唯一键
+
+    import_data.py 用 pandas 整表替换时会丢掉索引，所以每次启动都检查一次
+    """
+    with conn.cursor() as cursor:
+        # 列类型与 pandas.to_sql 建表一致
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                city_name TEXT,
+                year BIGINT,
+                month BIGINT,
+                price BIGINT
+            )
+        """)
+        cursor.execute(f"SHOW INDEX FROM {table_name} WHERE Key_name = %s", (UNIQUE_KEY_NAME,))
+        has_key = cursor.fetchone() is not None
+    conn.commit()
+    if not has_key:
+        # 旧爬虫 / CSV 追加导入可能留下同一城市同一月份的多行，先去重，否则唯一键建不起来
+        dedupe_prices(conn, table_name)
+        with conn.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE KEY {UNIQUE_KEY_NAME} (city_name(64), year, month)")
+        conn.commit()
+    ensure_city_columns(conn, table_name)
+
+
+def dedupe_prices(conn, table_name=PRICE_TABLE):
+    """
+    删除同一 (city_name, year, month) 的重复行，每组只保留一行
+
+    保留最后一行有效价格（没有则保留最后一行）；价格不一致的组逐条打印出来，
+    并登记受影响城市的新数据版本
+
+    Returns:
+        int: 删除的行数
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT city_name, year, month
+            FROM {table_name}
+            WHERE city_name IS NOT NULL AND year IS NOT NULL AND month IS NOT NULL
+            GROUP BY city_name, year, month
+            HAVING COUNT(*) > 1
+        """)
+        groups = cursor.fetchall()
+        if not groups:
+            return 0
+
+        removed = 0
+        conflicted = set()
+        for group in groups:
+            key = (group['city_name'], group['year'], group['month'])
+            where = "WHERE city_name = %s AND year = %s AND month = %s"
+            cursor.execute(f"SELECT * FROM {table_name} {where}", key)
+            rows = cursor.fetchall()
+            valid = [row for row in rows if row['price'] and row['price'] > 0]
+            keep = (valid or rows)[-1]
+            prices = sorted({row['price'] for row in valid})
+            if len(prices) > 1:
+                conflicted.add(key[0])
+                print(f"⚠️  {key[0]} {key[1]}-{int(key[2]):02d} 有 {len(rows)} 行且价格不一致 {prices}，保留 {keep['price']}")
+
+            columns = list(keep.keys())
+            cursor.execute(f"DELETE FROM {table_name} {where}", key)
+            cursor.execute(
+                f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                [keep[column] for column in columns]
+            )
+            removed += len(rows) - 1
+    conn.commit()
+
+    print(f"ℹ️  {table_name} 去除重复行 {removed} 行（{len(groups)} 组，价格不一致 {len(conflicted)} 个城市）")
+    if conflicted:
+        bump_version(conn, table_name, cities=conflicted, rows=len(groups))
+    return removed
+
+
+def upsert_prices(conn, rows, table_name=PRICE_TABLE):
+    """批量写入 (city_name, city_id, year, month, price)，已存在的月份更新价格"""
+    with conn.cursor() as cursor:
+        # pymysql 会把 INSERT ... VALUES 的 executemany 合并为多行插入
+        cursor.executemany(f"""
+            INSERT INTO {table_name} (city_name, city_id, year, month, price)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE city_id = VALUES(city_id), price = VALUES(price)
+        """, rows)
+    conn.commit()
+
+
+class PriceSink:
+    """爬取结果的流式写入器"""
+
+    def __init__(self, connection_factory, batch_size=500, flush_interval=2.0, max_pending=200,
+                 max_retries=5, on_flushed=None, table_name=PRICE_TABLE):
+        """
+        Args:
+            connection_factory: 返回数据库连接上下文管理器的函数（如 app.get_db_connection）
+            batch_size: 攒够多少行写一次
+            flush_interval: 最长多少秒写一次，保证数据尽快可见
+            max_pending: 队列中最多积压的批次数，超过后 write() 阻塞
+            max_retries: 写库失败的重试次数，仍失败则丢弃该批（由调用方重放）
+            on_flushed: 写入成功后的回调，参数为这批数据附带的 key 列表
+        """
+        self.connection_factory = connection_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.on_flushed = on_flushed
+        self.table_name = table_name
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='price-sink', daemon=True)
+        self.stats = {'rows': 0, 'flushes': 0, 'failed_rows': 0, 'blocked_seconds': 0.0}
+        self.error = None
+        self._thread.start()
+
+    def write(self, rows, key=None):
+        """
+        提交一批数据，写入线程跟不上时阻塞
+
+        Args:
+            rows: [(city_name, year, month, price), ...]
+            key: 这批数据的标识（如爬取任务），写入成功后传给 on_flushed
+        """
+        started = time.monotonic()
+        item = (list(rows), key)
+        while True:
+            if self.error is not None:
+                raise RuntimeError(f"写入线程已停止: {self.error}")
+            try:
+                self._queue.put(item, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.stats['blocked_seconds'] += time.monotonic() - started
+
+    def close(self):
+        """写完队列中剩余的数据并停止写入线程"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"写入线程已停止: {self.error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        try:
+            self._consume()
+        except Exception as e:
+            # 连不上数据库等致命错误：记录下来，write() / close() 会把它抛给调用方
+            print(f"❌ 写入线程异常退出: {e}")
+            self.error = e
+
+    def _consume(self):
+        pending_rows = []
+        pending_keys = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+
+        with self.connection_factory() as conn:
+            ensure_price_table(conn, self.table_name)
+            ensure_city_tables(conn)
+            self._city_index = load_index(conn)
+
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    stopping = True
+                elif item is not None:
+                    rows, key = item
+                    pending_rows.extend(rows)
+                    if key is not None:
+                        pending_keys.append(key)
+
+                if pending_rows and (stopping or len(pending_rows) >= self.batch_size
+                                     or time.monotonic() >= deadline):
+                    self._flush(conn, pending_rows, pending_keys)
+                    pending_rows = []
+                    pending_keys = []
+
+                if time.monotonic() >= deadline:
+                    deadline = time.monotonic() + self.flush_interval
+
+            # 爬取结束后对整张表做一次数据质量检查；检查失败不影响已写入的数据
+            if self.stats['rows'] > self.stats['failed_rows']:
+                try:
+                    run_quality_pass(conn, self.table_name)
+                except Exception as e:
+                    print(f"⚠️  数据质量检查失败: {e}")
+
+    def _flush(self, conn, rows, keys):
+        for attempt in range(self.max_retries + 1):
+            try:
+                # 统一城市名写法并附上城市ID，新城市在维度表中登记
+                cities = register_cities(conn, {row[0] for row in rows}, self._city_index)
+                records = [(cities[name]['city_name'], cities[name]['city_id'], year, month, price)
+                           for name, year, month, price in rows]
+                upsert_prices(conn, records, self.table_name)
+                # 只通知受影响的城市，已打开页面上的其他城市不必刷新
+                bump_version(conn, self.table_name, cities={row[0] for row in records}, rows=len(rows))
+                break
+            except Exception as e:
+                print(f"⚠️  写入数据库失败（第 {attempt + 1} 次）: {e}")
+                if attempt == self.max_retries:
+                    self.stats['failed_rows'] += len(rows)
+                    return
+                time.sleep(min(2 ** attempt, 30))
+                try:
+                    conn.rollback()
+                    conn.ping(reconnect=True)
+                except Exception:
+                    pass
+
+        self.stats['rows'] += len(rows)
+        self.stats['flushes'] += 1
+        if self.on_flushed and keys:
+            self.on_flushed(keys)
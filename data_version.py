@@ -0,0 +1,180 @@
+# 数据版本登记表：导入脚本写入新数据后递增对应表的版本号，
+# Web端轮询该表即可知道数据是否更新以及哪些城市受影响。
+# 每个城市另记最近一次被更新时的表版本，缓存条目按所依赖城市的版本判断是否过期，
+# 只导入部分城市时其他城市的缓存不受影响
+import json
+
+VERSION_TABLE = 'data_version'
+CITY_VERSION_TABLE = 'data_version_city'
+
+
+def ensure_version_table(conn):
+    """创建数据版本表（如果不存在）"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+                table_name VARCHAR(64) NOT NULL PRIMARY KEY,
+                version INT NOT NULL DEFAULT 0,
+                changed_cities TEXT NULL,
+                changed_rows INT NULL,
+                full_version INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+        # 早期版本的版本表没有 full_version 列（最近一次整表更新时的版本）
+        cursor.execute(f"SHOW COLUMNS FROM {VERSION_TABLE} LIKE 'full_version'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {VERSION_TABLE} ADD COLUMN full_version INT NOT NULL DEFAULT 0")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CITY_VERSION_TABLE} (
+                table_name VARCHAR(64) NOT NULL,
+                city_name VARCHAR(64) NOT NULL,
+                version INT NOT NULL,
+                PRIMARY KEY (table_name, city_name)
+            )
+        """)
+    conn.commit()
+
+
+def bump_version(conn, table_name, cities=None, rows=None):
+    """
+    递增指定数据表的版本号，并记录受影响城市的版本
+
+    Args:
+        conn: 数据库连接（pymysql 或 SQLAlchemy 的 raw_connection）
+        table_name: 被更新的数据表名
+        cities: 本次受影响的城市列表，None 表示全表
+        rows: 本次写入的行数
+
+    Returns:
+        int: 更新后的版本号
+    """
+    ensure_version_table(conn)
+    changed_cities = json.dumps(sorted(set(cities))) if cities is not None else None
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {VERSION_TABLE} (table_name, version, changed_cities, changed_rows)
+            VALUES (%s, 1, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                version = version + 1,
+                changed_cities = VALUES(changed_cities),
+                changed_rows = VALUES(changed_rows)
+        """, (table_name, changed_cities, rows))
+        cursor.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = %s", (table_name,))
+        row = cursor.fetchone()
+        version = row['version'] if isinstance(row, dict) else row[0]
+
+        if cities is None:
+            cursor.execute(f"UPDATE {VERSION_TABLE} SET full_version = %s WHERE table_name = %s",
+                           (version, table_name))
+        elif cities:
+            cursor.executemany(f"""
+                INSERT INTO {CITY_VERSION_TABLE} (table_name, city_name, version) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE version = VALUES(version)
+            """, [(table_name, city, version) for city in sorted(set(cities))])
+    conn.commit()
+
+    return version
+
+
+def fetch_versions(conn):
+    """
+    读取所有数据表的当前版本
+
+    Returns:
+        dict: {table_name: {'version': int, 'cities': list 或 None, 'rows': int 或 None,
+                            'full': 最近一次整表更新的版本, 'city_versions': {city_name: 版本}}}
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW TABLES LIKE %s", (VERSION_TABLE,))
+        if not cursor.fetchone():
+            return {}
+        # 早期版本的表没有 full_version 列，取全部列再按列名读
+        cursor.execute(f"SELECT * FROM {VERSION_TABLE}")
+        results = cursor.fetchall()
+
+        city_rows = []
+        cursor.execute("SHOW TABLES LIKE %s", (CITY_VERSION_TABLE,))
+        if cursor.fetchone():
+            cursor.execute(f"SELECT table_name, city_name, version FROM {CITY_VERSION_TABLE}")
+            city_rows = cursor.fetchall()
+
+    versions = {}
+    for row in results:
+        versions[row['table_name']] = {
+            'version': row['version'],
+            'cities': json.loads(row['changed_cities']) if row['changed_cities'] else None,
+            'rows': row['changed_rows'],
+            'full': row.get('full_version') or 0,
+            'city_versions': {}
+        }
+    for row in city_rows:
+        if row['table_name'] in versions:
+            versions[row['table_name']]['city_versions'][row['city_name']] = row['version']
+    return versions
+
+
+def city_version(info, city):
+    """某城市数据的版本：该城市最近一次被更新或整表最近一次被替换时的表版本，取较新的"""
+    return max(info.get('full', 0), info.get('city_versions', {}).get(city, 0))
+
+
+def dependency_stamp(versions, depends_on):
+    """
+    缓存条目所依赖数据的版本戳，依赖的数据都没有更新时版本戳不变
+
+    Args:
+        versions: fetch_versions 的结果
+        depends_on: [(table_name, city_name), ...]，city_name 为 None 表示依赖整张表
+
+    Returns:
+        tuple: 与 depends_on 一一对应的版本号
+    """
+    stamp = []
+    for table_name, city in depends_on:
+        info = versions.get(table_name, {})
+        stamp.append(info.get('version', 0) if city is None else city_version(info, city))
+    return tuple(stamp)
+
+
+def version_token(versions):
+    """把各表版本号拼成一个稳定的字符串，多进程之间可直接比较"""
+    return ','.join(f"{name}:{info['version']}" for name, info in sorted(versions.items()))
+
+
+def parse_token(token):
+    """version_token 的逆操作，用于和客户端上报的版本比较"""
+    versions = {}
+    for part in (token or '').split(','):
+        name, _, version = part.rpartition(':')
+        if name and version.isdigit():
+            versions[name] = {'version': int(version)}
+    return versions
+
+
+def diff_versions(old, new):
+    """
+    比较两次读取的版本，生成变更摘要
+
+    中间隔了多个版本时，按各城市的版本找出 old 之后更新过的城市；
+    只有期间发生过整表更新（或没有旧版本可比）时 cities 才记为 None（整表刷新）
+    """
+    changed = {}
+    for name, info in new.items():
+        old_version = old.get(name, {}).get('version', 0)
+        if info['version'] == old_version:
+            continue
+        if info['version'] - old_version == 1:
+            cities = info['cities']
+        elif old_version == 0 or info.get('full', 0) > old_version:
+            cities = None
+        else:
+            cities = sorted(city for city, version in info.get('city_versions', {}).items()
+                            if version > old_version)
+        changed[name] = {
+            'version': info['version'],
+            'cities': cities,
+            'rows': info['rows']
+        }
+    return changed
@@ -0,0 +1,139 @@
+# 数据更新推送：每个进程只有一个后台线程轮询版本表，
+# 再把变更广播给所有 SSE / 长轮询客户端，避免每个浏览器各自查库
+import queue
+import random
+import threading
+import time
+
+from data_version import fetch_versions, version_token, parse_token, diff_versions
+
+
+class VersionWatcher:
+    """轮询数据版本表并向订阅者广播变更摘要"""
+
+    def __init__(self, connection_factory, poll_interval=5):
+        """
+        Args:
+            connection_factory: 返回数据库连接上下文管理器的函数（如 app.get_db_connection）
+            poll_interval: 轮询间隔（秒）
+        """
+        self.connection_factory = connection_factory
+        self.poll_interval = poll_interval
+        self.versions = None
+        self.token = ''
+        self.last_event = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._thread = None
+
+    def start(self):
+        """首次订阅时才启动后台线程，导入 app 时不访问数据库"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='version-watcher', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, maxsize=16):
+        """注册一个订阅队列"""
+        self.start()
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def snapshot(self):
+        """当前版本（首次调用时同步读取一次）"""
+        if self.versions is None:
+            self.poll_once()
+        return {
+            'token': self.token,
+            'tables': self.versions or {}
+        }
+
+    def changes_since(self, since):
+        """客户端持有的版本 token 与当前版本的差异，一致时返回 None"""
+        if self.versions is None or since == self.token:
+            return None
+        return {
+            'token': self.token,
+            'changed': diff_versions(parse_token(since), self.versions)
+        }
+
+    def wait_for_change(self, since, timeout):
+        """长轮询：等待版本 token 与 since 不同，超时返回 None"""
+        self.start()
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self.versions is None or since == self.token:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+            return self.changes_since(since)
+
+    def poll_once(self):
+        """读取一次版本表，有变化时广播"""
+        try:
+            with self.connection_factory() as conn:
+                versions = fetch_versions(conn)
+        except Exception as e:
+            print(f"读取数据版本错误: {e}")
+            return
+
+        with self._changed:
+            if self.versions is None:
+                # 第一次读取只记录基线，不算变更
+                self.versions = versions
+                self.token = version_token(versions)
+                self._changed.notify_all()
+                return
+
+            changed = diff_versions(self.versions, versions)
+            if not changed:
+                return
+
+            self.versions = versions
+            self.token = version_token(versions)
+            event = {'token': self.token, 'changed': changed}
+            self.last_event = event
+            subscribers = list(self._subscribers)
+            self._changed.notify_all()
+
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 客户端消费太慢时丢弃旧消息，只保留最新状态
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _run(self):
+        while True:
+            self.poll_once()
+            time.sleep(self.poll_interval)
+
+
+def retry_with_jitter(base_ms=3000, spread_ms=7000):
+    """SSE 的 retry 字段：服务重启时让客户端分散重连"""
+    return base_ms + random.randint(0, spread_ms)
+
+
+def format_sse(data, event=None, event_id=None):
+    """把已序列化的 JSON 字符串格式化为 SSE 消息"""
+    message = ''
+    if event_id:
+        # 断线重连时浏览器会通过 Last-Event-ID 带回该值
+        message += f"id: {event_id}\n"
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {data}\n\n"
+    return message
@@ -0,0 +1,333 @@
+# 数据质量检查：导入后对整张价格表做一次向量化扫描，标记缺失月份、零值/不合理价格、
+# 重复行和异常跳变（按城市的滚动 z 分数），结果写入 data_quality_flags，
+# 接口把不合理价格和单点尖峰当作缺失值返回 null，而不是 0
+import argparse
+import time
+
+import numpy as np
+
+FLAG_TABLE = 'data_quality_flags'
+
+FLAG_GAP = 'gap'
+FLAG_INVALID = 'invalid'
+FLAG_DUPLICATE = 'duplicate'
+FLAG_OUTLIER = 'outlier'
+FLAG_JUMP = 'jump'
+
+# 接口中按缺失值处理的标记：持续的跳变可能是真实行情，只记录不屏蔽
+MASKED_FLAGS = (FLAG_INVALID, FLAG_OUTLIER)
+
+# 合理的房价范围（元/平方米）
+MIN_PRICE = 1000
+MAX_PRICE = 500000
+
+# 合理的年份范围：最早的年份，最晚不超过明年
+MIN_YEAR = 1990
+
+# 异常跳变：对数涨跌幅相对前 window 期的 z 分数超过阈值，且涨跌幅本身超过 min_jump；
+# 下一期又大幅反向跳回的是单点尖峰（outlier），否则是跳变（jump）
+Z_THRESHOLD = 4.0
+
+# 各价格表的检查参数
+TABLE_SETTINGS = {
+    'monthly_price_for_all': {'monthly': True, 'window': 12, 'min_jump': 0.1},
+    'yearly_price_for_all': {'monthly': False, 'window': 5, 'min_jump': 0.3},
+}
+
+
+def flag_version_name(table_name):
+    """数据版本表中登记某张价格表标记的名称：两张价格表的标记各自记版本，互不影响缓存"""
+    return f"{FLAG_TABLE}.{table_name}"
+
+
+def _flag(city, period, monthly, flag, price=None, detail=None):
+    year, month = (period // 12, period % 12 + 1) if monthly else (period, None)
+    return {
+        'city_name': city,
+        'year': int(year),
+        'month': month if month is None else int(month),
+        'flag': flag,
+        'price': price,
+        'detail': detail
+    }
+
+
+def _trailing_sum(values, window):
+    """每个位置之前 window 期（不含当期）的和，values 为 城市 × 时间 矩阵"""
+    cumulative = np.concatenate([np.zeros((values.shape[0], 1)), np.cumsum(values, axis=1)], axis=1)
+    end = np.arange(values.shape[1])
+    start = np.maximum(end - window, 0)
+    return cumulative[:, end] - cumulative[:, start]
+
+
+def check_prices(rows, monthly=True, window=12, min_jump=0.1, z_threshold=Z_THRESHOLD):
+    """
+    检查价格面板数据
+
+    Args:
+        rows: 月度 [(city_name, year, month, price), ...]；年度 month 为 None
+        monthly: 是否月度数据
+        window: 计算滚动 z 分数的期数
+
+    Returns:
+        list: 标记字典列表，见 _flag
+    """
+    if not rows:
+        return []
+
+    cities = sorted({row[0] for row in rows})
+    lookup = {city: i for i, city in enumerate(cities)}
+    flags = []
+
+    # 年份、月份超出合理范围的行（如月份写成了年份）不放进时间轴，直接标记为 invalid，
+    # 按库中原样的年份、月份记录，接口按缺失值处理
+    max_year = time.localtime().tm_year + 1
+    valid_rows = []
+    for row in rows:
+        year, month = row[1], row[2]
+        if year is not None and MIN_YEAR <= year <= max_year and (not monthly or month is not None and 1 <= month <= 12):
+            valid_rows.append(row)
+            continue
+        flags.append({
+            'city_name': row[0],
+            'year': int(year or 0),
+            'month': None if month is None else int(month),
+            'flag': FLAG_INVALID,
+            'price': None if row[3] is None else float(row[3]),
+            'detail': f"时间不合理：年份应在 {MIN_YEAR}-{max_year}" + ("，月份应在 1-12" if monthly else "")
+        })
+    rows = valid_rows
+    if not rows:
+        return flags
+
+    city_idx = np.array([lookup[row[0]] for row in rows], dtype=np.int64)
+    years = np.array([row[1] for row in rows], dtype=np.int64)
+    periods = years * 12 + np.array([row[2] for row in rows], dtype=np.int64) - 1 if monthly else years
+    prices = np.array([np.nan if row[3] is None else row[3] for row in rows], dtype=float)
+    first_period = int(periods.min())
+    n_periods = int(periods.max()) - first_period + 1
+
+    # 零值、缺失和超出合理范围的价格
+    invalid = ~((prices >= MIN_PRICE) & (prices <= MAX_PRICE))
+    for i in np.flatnonzero(invalid):
+        price = None if np.isnan(prices[i]) else float(prices[i])
+        flags.append(_flag(cities[city_idx[i]], periods[i], monthly, FLAG_INVALID, price,
+                           f"价格不在 {MIN_PRICE}-{MAX_PRICE} 范围内"))
+
+    # 同一城市同一时间出现多次：保留最后一条，其余标记为重复
+    keys = city_idx * n_periods + (periods - first_period)
+    order = np.argsort(keys, kind='stable')
+    duplicate = np.zeros(len(rows), dtype=bool)
+    duplicate[order[:-1]] = keys[order[:-1]] == keys[order[1:]]
+    for i in np.flatnonzero(duplicate):
+        price = None if np.isnan(prices[i]) else float(prices[i])
+        flags.append(_flag(cities[city_idx[i]], periods[i], monthly, FLAG_DUPLICATE, price, "重复记录"))
+
+    # 城市 × 时间 的对数价格矩阵
+    keep = ~invalid & ~duplicate
+    matrix = np.full((len(cities), n_periods), np.nan)
+    matrix[city_idx[keep], periods[keep] - first_period] = np.log(prices[keep])
+    raw_prices = np.full_like(matrix, np.nan)
+    raw_prices[city_idx[keep], periods[keep] - first_period] = prices[keep]
+    observed = ~np.isnan(matrix)
+
+    # 首末记录之间完全没有记录的月份 / 年份（有记录但价格不合理的已标记为 invalid）
+    present = np.zeros_like(observed)
+    present[city_idx, periods - first_period] = True
+    seen_before = np.cumsum(present, axis=1) > 0
+    seen_after = np.cumsum(present[:, ::-1], axis=1)[:, ::-1] > 0
+    for c, t in zip(*np.nonzero(~present & seen_before & seen_after)):
+        flags.append(_flag(cities[c], first_period + t, monthly, FLAG_GAP, None, "缺失数据"))
+
+    # 异常跳变：当期对数涨跌幅相对之前 window 期涨跌幅的 z 分数
+    returns = np.full_like(matrix, np.nan)
+    returns[:, 1:] = matrix[:, 1:] - matrix[:, :-1]
+    has_return = ~np.isnan(returns)
+    filled = np.where(has_return, returns, 0.0)
+    count = _trailing_sum(has_return.astype(float), window)
+    total = _trailing_sum(filled, window)
+    total_sq = _trailing_sum(filled ** 2, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+        z = (returns - mean) / std
+    jump = has_return & (count >= max(window // 2, 3)) & (std > 0) \
+        & (np.abs(z) > z_threshold) & (np.abs(returns) > np.log1p(min_jump))
+    # 下一期反向跳回至少一半的是单点尖峰；尖峰之后那次回落不再单独标记
+    next_returns = np.full_like(returns, np.nan)
+    next_returns[:, :-1] = returns[:, 1:]
+    with np.errstate(invalid='ignore'):
+        spike = jump & (np.sign(next_returns) == -np.sign(returns)) \
+            & (np.abs(next_returns) >= 0.5 * np.abs(returns)) & (np.abs(next_returns) > np.log1p(min_jump))
+    rebound = np.zeros_like(spike)
+    rebound[:, 1:] = spike[:, :-1]
+    for c, t in zip(*np.nonzero(jump & ~rebound)):
+        flags.append(_flag(cities[c], first_period + t, monthly, FLAG_OUTLIER if spike[c, t] else FLAG_JUMP,
+                           float(raw_prices[c, t]), f"涨跌幅 {np.expm1(returns[c, t]) * 100:+.1f}%，z={z[c, t]:.1f}"))
+
+    return flags
+
+
+def summarize(flags):
+    """按标记类型计数"""
+    summary = {flag: 0 for flag in (FLAG_GAP, FLAG_INVALID, FLAG_DUPLICATE, FLAG_OUTLIER, FLAG_JUMP)}
+    for item in flags:
+        summary[item['flag']] += 1
+    return summary
+
+
+def ensure_flag_table(conn):
+    """创建数据质量标记表"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {FLAG_TABLE} (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                table_name VARCHAR(64) NOT NULL,
+                city_name VARCHAR(64) NOT NULL,
+                year INT NOT NULL,
+                month INT NULL,
+                flag VARCHAR(16) NOT NULL,
+                price DOUBLE NULL,
+                detail VARCHAR(255) NULL,
+                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_quality_table_flag (table_name, flag)
+            )
+        """)
+    conn.commit()
+
+
+def fetch_rows(conn, table_name):
+    """读取价格表的全部 (city_name, year, month, price)，年度表 month 为 None"""
+    month_column = 'month' if TABLE_SETTINGS[table_name]['monthly'] else 'NULL AS month'
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT city_name, year, {month_column}, price FROM {table_name}")
+        rows = cursor.fetchall()
+    rows = [row if isinstance(row, dict) else dict(zip(('city_name', 'year', 'month', 'price'), row)) for row in rows]
+    return [
+        (row['city_name'], row['year'], row['month'], None if row['price'] is None else float(row['price']))
+        for row in rows
+    ]
+
+
+def store_flags(conn, table_name, flags):
+    """替换该表的全部标记（一个事务内完成）"""
+    ensure_flag_table(conn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FLAG_TABLE} WHERE table_name = %s", (table_name,))
+            cursor.executemany(f"""
+                INSERT INTO {FLAG_TABLE} (table_name, city_name, year, month, flag, price, detail)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, [
+                (table_name, item['city_name'], item['year'], item['month'], item['flag'], item['price'], item['detail'])
+                for item in flags
+            ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _flags_by_city(rows):
+    """{city_name: {(year, month, flag), ...}}，用于比较两次检查的结果"""
+    by_city = {}
+    for row in rows:
+        by_city.setdefault(row['city_name'], set()).add((row['year'], row['month'], row['flag']))
+    return by_city
+
+
+def fetch_flags(conn, table_name):
+    """读取该表已保存的标记"""
+    ensure_flag_table(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT city_name, year, month, flag FROM {FLAG_TABLE} WHERE table_name = %s", (table_name,))
+        rows = cursor.fetchall()
+    return [row if isinstance(row, dict) else dict(zip(('city_name', 'year', 'month', 'flag'), row)) for row in rows]
+
+
+def run_quality_pass(conn, table_name):
+    """
+    检查一张价格表并保存标记，导入脚本在写入数据后调用
+
+    Returns:
+        dict: 各类标记的数量
+    """
+    from data_version import bump_version
+
+    settings = TABLE_SETTINGS[table_name]
+    started = time.perf_counter()
+    flags = check_prices(fetch_rows(conn, table_name), **settings)
+    previous = _flags_by_city(fetch_flags(conn, table_name))
+    store_flags(conn, table_name, flags)
+
+    # 只登记标记有变化的城市，其他城市的接口缓存不受影响
+    current = _flags_by_city(flags)
+    changed = {city for city in previous.keys() | current.keys() if previous.get(city) != current.get(city)}
+    if changed:
+        bump_version(conn, flag_version_name(table_name), cities=changed, rows=len(flags))
+
+    summary = summarize(flags)
+    print(f"📊 {table_name} 数据质量检查完成（{time.perf_counter() - started:.2f} 秒）: "
+          + ', '.join(f"{flag} {count}" for flag, count in summary.items()))
+    return summary
+
+
+def load_masked(conn, table_name):
+    """
+    接口中应按缺失值处理的 (city_name, year, month)，年度表 month 为 None
+
+    标记表不存在（从未检查过）时返回空集合
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW TABLES LIKE %s", (FLAG_TABLE,))
+        if not cursor.fetchone():
+            return frozenset()
+        placeholders = ','.join(['%s'] * len(MASKED_FLAGS))
+        cursor.execute(f"""
+            SELECT city_name, year, month FROM {FLAG_TABLE}
+            WHERE table_name = %s AND flag IN ({placeholders})
+        """, (table_name,) + MASKED_FLAGS)
+        rows = cursor.fetchall()
+    return frozenset(
+        (row['city_name'], row['year'], row['month']) if isinstance(row, dict) else tuple(row)
+        for row in rows
+    )
+
+
+def main():
+    import csv
+    import os
+
+    parser = argparse.ArgumentParser(description="价格数据质量检查")
+    parser.add_argument('--table', choices=sorted(TABLE_SETTINGS), help="检查数据库中的价格表并保存标记，默认全部")
+    parser.add_argument('--csv', action='store_true', help="只检查 data/ 下的 CSV，不连接数据库")
+    parser.add_argument('--show', type=int, default=20, help="打印前几条标记")
+    args = parser.parse_args()
+
+    if args.csv:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        sources = {'monthly_price_for_all': 'monthly_price.csv', 'yearly_price_for_all': 'yearly_price.csv'}
+        for table_name, filename in sources.items():
+            settings = TABLE_SETTINGS[table_name]
+            with open(os.path.join(base_dir, 'data', filename), encoding='utf-8-sig') as f:
+                rows = [(row['city_name'], int(row['year']),
+                         int(row['month']) if settings['monthly'] else None,
+                         float(row['price']) if row['price'] else None)
+                        for row in csv.DictReader(f)]
+            started = time.perf_counter()
+            flags = check_prices(rows, **settings)
+            elapsed = time.perf_counter() - started
+            print(f"📊 {filename}: {len(rows)} 行，耗时 {elapsed * 1000:.1f} ms，{summarize(flags)}")
+            for item in flags[:args.show]:
+                print(f"  {item['flag']:9s} {item['city_name']:14s} {item['year']}"
+                      f"{'' if item['month'] is None else '-%02d' % item['month']}  {item['detail']}")
+        return
+
+    from storage import open_connection
+    with open_connection() as conn:
+        for table_name in [args.table] if args.table else sorted(TABLE_SETTINGS):
+            run_quality_pass(conn, table_name)
+
+
+if __name__ == "__main__":
+    main()
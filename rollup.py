@@ -0,0 +1,157 @@
+# 空间汇总：把城市房价按省份、区域（东/中/西部）和城市等级聚合，
+# 计算人口加权平均价和中位数；每个数据版本对所有年份/月份一次性向量化算好，接口只取切片
+import numpy as np
+
+LEVELS = ('province', 'region', 'tier')
+SOURCES = ('yearly', 'monthly')
+
+# 没有登记人口的城市按一个普通地级市的人口（万人）计权
+DEFAULT_POPULATION = 500
+UNKNOWN_GROUP = 'Unknown'
+
+
+def period_key(year, month=None):
+    """汇总的时间键：年度 '2020'，月度 '2020-06'"""
+    return str(year) if month is None else f"{year}-{int(month):02d}"
+
+
+def group_of(city, level):
+    """城市所属的分组名"""
+    if level == 'province':
+        return city.get('province_en') or UNKNOWN_GROUP
+    return city.get(level) or UNKNOWN_GROUP
+
+
+def _group_stats(keys, values, weights):
+    """
+    按分组键计算统计量，values 中的 NaN 不参与计算
+
+    Returns:
+        tuple: (分组键, 数量, 加权平均, 中位数, 最小值, 最大值)，均为数组
+    """
+    mask = ~np.isnan(values)
+    keys, values, weights = keys[mask], values[mask], weights[mask]
+    if len(keys) == 0:
+        empty = np.array([])
+        return empty.astype(np.int64), empty, empty, empty, empty, empty
+
+    # 先按分组键、再按数值排序，每组是一段连续区间，中位数和极值直接按下标取
+    order = np.lexsort((values, keys))
+    keys, values, weights = keys[order], values[order], weights[order]
+    unique_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+
+    weighted_sum = np.add.reduceat(values * weights, starts)
+    weight_sum = np.add.reduceat(weights, starts)
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    return unique_keys, counts, weighted_sum / weight_sum, medians, values[starts], values[starts + counts - 1]
+
+
+def _month_over_month(city_idx, month_idx, prices):
+    """按城市计算月度环比（%），上个月缺失时为 NaN"""
+    order = np.lexsort((month_idx, city_idx))
+    sorted_city, sorted_month, sorted_price = city_idx[order], month_idx[order], prices[order]
+    consecutive = (sorted_city[1:] == sorted_city[:-1]) & (sorted_month[1:] == sorted_month[:-1] + 1) \
+        & (sorted_price[:-1] > 0)
+    rates = np.full(len(prices), np.nan)
+    rates[1:][consecutive] = (sorted_price[1:][consecutive] / sorted_price[:-1][consecutive] - 1) * 100
+    change = np.empty_like(rates)
+    change[order] = rates
+    return change
+
+
+def compute_rollups(rows, index, source='yearly', levels=LEVELS):
+    """
+    一次性计算所有时间点、所有层级的汇总
+
+    Args:
+        rows: 年度 [(city_name, year, price, change_rate), ...]；
+              月度 [(city_name, year, month, price), ...]
+        index: city_dim.CityIndex，提供省份、区域、等级和人口
+        source: 'yearly' / 'monthly'
+
+    Returns:
+        dict: {level: {period: [分组统计, ...]}}，分组按加权平均价从高到低排列
+    """
+    if not rows:
+        return {level: {} for level in levels}
+
+    names = sorted({row[0] for row in rows})
+    name_idx = {name: i for i, name in enumerate(names)}
+    cities = []
+    for name in names:
+        city = index.resolve(name) or {'city_name': name, 'display_name': name}
+        cities.append(city)
+
+    city_idx = np.array([name_idx[row[0]] for row in rows], dtype=np.int64)
+    if source == 'monthly':
+        years = np.array([row[1] for row in rows], dtype=np.int64)
+        months = np.array([row[2] for row in rows], dtype=np.int64)
+        prices = np.array([row[3] for row in rows], dtype=float)
+        month_idx = years * 12 + months - 1
+        changes = _month_over_month(city_idx, month_idx, prices)
+        period_codes, period_idx = np.unique(month_idx, return_inverse=True)
+        periods = [period_key(code // 12, code % 12 + 1) for code in period_codes]
+    else:
+        years = np.array([row[1] for row in rows], dtype=np.int64)
+        prices = np.array([row[2] for row in rows], dtype=float)
+        changes = np.array([np.nan if row[3] is None else row[3] for row in rows], dtype=float)
+        period_codes, period_idx = np.unique(years, return_inverse=True)
+        periods = [period_key(code) for code in period_codes]
+
+    population = np.array([city.get('population') or DEFAULT_POPULATION for city in cities], dtype=float)
+    weights = population[city_idx]
+    # 价格缺失或为0的行不参与汇总
+    prices[~(prices > 0)] = np.nan
+
+    result = {}
+    for level in levels:
+        group_names = sorted({group_of(city, level) for city in cities})
+        group_lookup = {name: i for i, name in enumerate(group_names)}
+        city_group = np.array([group_lookup[group_of(city, level)] for city in cities], dtype=np.int64)
+        keys = period_idx * len(group_names) + city_group[city_idx]
+
+        # 每个时间点每组实际参与汇总的城市和省份（地图按省份着色），该时间点没有有效价格的城市不计入
+        members = {}
+        valid = ~np.isnan(prices)
+        pairs = np.unique(keys[valid] * len(cities) + city_idx[valid])
+        for key, city_i in zip(*(part.tolist() for part in np.divmod(pairs, len(cities)))):
+            city = cities[city_i]
+            group = members.setdefault(key, {'cities': [], 'provinces': []})
+            group['cities'].append(city.get('display_name') or city['city_name'])
+            if city.get('province') and city['province'] not in group['provinces']:
+                group['provinces'].append(city['province'])
+
+        price_stats = _group_stats(keys, prices, weights)
+        change_stats = _group_stats(keys, changes, weights)
+        change_by_key = {
+            key: (avg, median)
+            for key, avg, median in zip(change_stats[0].tolist(), change_stats[2].tolist(), change_stats[3].tolist())
+        }
+
+        by_period = {period: [] for period in periods}
+        for key, count, avg, median, low, high in zip(*(stat.tolist() for stat in price_stats)):
+            period, group_i = divmod(key, len(group_names))
+            group_name = group_names[group_i]
+            change = change_by_key.get(key)
+            by_period[periods[period]].append({
+                'name': group_name,
+                'cities': members[key]['cities'],
+                'provinces': members[key]['provinces'],
+                'count': count,
+                'price': {
+                    'avg': round(avg, 2),
+                    'median': round(median, 2),
+                    'min': round(low, 2),
+                    'max': round(high, 2)
+                },
+                'changeRate': {
+                    'avg': round(change[0], 2),
+                    'median': round(change[1], 2)
+                } if change else None
+            })
+
+        for groups in by_period.values():
+            groups.sort(key=lambda group: group['price']['avg'], reverse=True)
+        result[level] = by_period
+
+    return result
@@ -0,0 +1,76 @@
+# 请求合并（single-flight）：相同的请求同时到达时只计算一次，
+# 其余请求等待并共享同一份结果
+import threading
+
+
+class _Call:
+    """一次正在进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按 key 合并并发调用，并统计合并次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def do(self, key, fn):
+        """
+        执行 fn，同一 key 的并发调用只执行一次
+
+        Args:
+            key: 规范化后的请求键，第一个元素作为统计分组名（如接口名）
+            fn: 无参数的计算函数
+
+        Returns:
+            tuple: (结果, 是否为合并得到的结果)
+        """
+        group = key[0] if isinstance(key, tuple) else key
+
+        with self._lock:
+            stats = self._stats.setdefault(group, {'calls': 0, 'executions': 0, 'coalesced': 0, 'errors': 0})
+            stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            # 先移除再唤醒，之后到达的请求会重新计算，拿到的是最新数据
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def metrics(self):
+        """各分组的调用、实际执行、合并次数"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'groups': {name: dict(stats) for name, stats in self._stats.items()}
+            }
@@ -0,0 +1,447 @@
+# 存储后端：app.py 通过后端对象获取数据库连接，可选 MySQL（默认）或内嵌 SQLite。
+# SQLite 库由 data/*.csv 生成，不需要数据库服务，开发、测试、性能测试和边缘设备都可以直接使用；
+# SQLite 连接模仿 pymysql 的 DictCursor 接口，并把 MySQL 专有语句翻译成等价的 SQLite 语句，
+# 各模块的查询语句不用改
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BASE_DIR, 'data')
+DEFAULT_SQLITE_PATH = os.path.join(DEFAULT_DATA_DIR, 'housing_price.db')
+
+# MySQL 数据库配置，app.py 和导入、同步等命令行工具共用
+MYSQL_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '123456',
+    'database': 'housing_price',
+    'charset': 'utf8mb4'
+}
+
+# 由 CSV 生成的价格表：{表名: (CSV 文件名, {列名: 类型}, 时间列)}
+# city_name 用 NOCASE 排序规则，与 MySQL 默认的不区分大小写比较一致；city_id 列和索引由 city_dim 补上
+CSV_TABLES = {
+    'monthly_price_for_all': (
+        'monthly_price.csv',
+        {'city_name': 'TEXT COLLATE NOCASE', 'year': 'INTEGER', 'month': 'INTEGER', 'price': 'REAL'},
+        ('year', 'month')
+    ),
+    'yearly_price_for_all': (
+        'yearly_price.csv',
+        {'city_name': 'TEXT COLLATE NOCASE', 'year': 'INTEGER', 'price': 'REAL', 'change_rate': 'REAL'},
+        ('year',)
+    ),
+}
+
+# 只读模式下的内存映射大小，整库通常只有几 MB
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+# ============ MySQL 语句翻译 ============
+
+_SHOW_TABLES = re.compile(r'^\s*SHOW\s+TABLES\s+LIKE\s+(.+?)\s*$', re.I | re.S)
+_SHOW_COLUMNS = re.compile(r'^\s*SHOW\s+COLUMNS\s+FROM\s+(\w+)\s+LIKE\s+(.+?)\s*$', re.I | re.S)
+_SHOW_INDEX = re.compile(r'^\s*SHOW\s+INDEX\s+FROM\s+(\w+)\s+WHERE\s+Key_name\s*=\s*(.+?)\s*$', re.I | re.S)
+_ADD_INDEX = re.compile(r'^\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\((.*)\)\s*$', re.I | re.S)
+_SNAPSHOT = re.compile(r'^\s*START\s+TRANSACTION\b', re.I)
+_CREATE_TABLE = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.I)
+_INLINE_INDEX = re.compile(r',\s*(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)', re.I)
+_PREFIX_LENGTH = re.compile(r'(\w+)\s*\(\d+\)')
+_AUTO_INCREMENT = re.compile(r'\b\w*INT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', re.I)
+_ON_DUPLICATE = re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.I)
+_VALUES_REF = re.compile(r'\bVALUES\((\w+)\)', re.I)
+
+
+def _create_index(table, name, columns, unique=False):
+    # MySQL 的索引名在表内唯一，SQLite 在整个库内唯一，实际索引名加上表名前缀；
+    # 索引列的前缀长度（city_name(64)）SQLite 不需要
+    columns = _PREFIX_LENGTH.sub(r'\1', columns)
+    return f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {table}__{name} ON {table} ({columns})"
+
+
+@lru_cache(maxsize=512)
+def translate_sql(query):
+    """
+    把 MySQL 语句翻译成 SQLite 语句
+
+    Returns:
+        tuple: SQLite 语句列表；参数只传给第一条（建表语句拆出来的索引语句没有参数）
+    """
+    query = query.replace('%s', '?')
+
+    match = _SHOW_TABLES.match(query)
+    if match:
+        return (f"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE {match.group(1)}",)
+    match = _SHOW_COLUMNS.match(query)
+    if match:
+        return (f"SELECT name AS Field FROM pragma_table_info('{match.group(1)}') WHERE name LIKE {match.group(2)}",)
+    match = _SHOW_INDEX.match(query)
+    if match:
+        table = match.group(1)
+        return (f"SELECT substr(name, {len(table) + 3}) AS Key_name FROM sqlite_master "
+                f"WHERE type = 'index' AND tbl_name = '{table}' AND name = '{table}__' || {match.group(2)}",)
+    match = _ADD_INDEX.match(query)
+    if match:
+        return (_create_index(match.group(1), match.group(3), match.group(4), bool(match.group(2))),)
+    if _SNAPSHOT.match(query):
+        # 只读一致性快照：BEGIN 之后的第一次读取固定快照（WAL 模式下写入不会阻塞它）
+        return ('BEGIN', 'SELECT 1 FROM sqlite_master LIMIT 1')
+
+    match = _CREATE_TABLE.match(query)
+    if match:
+        table = match.group(1)
+        indexes = [_create_index(table, name, columns, bool(unique))
+                   for unique, name, columns in _INLINE_INDEX.findall(query)]
+        query = _INLINE_INDEX.sub('', query)
+        query = _AUTO_INCREMENT.sub('INTEGER PRIMARY KEY AUTOINCREMENT', query)
+        query = re.sub(r'\bON\s+UPDATE\s+CURRENT_TIMESTAMP\b', '', query, flags=re.I)
+        return (query,) + tuple(indexes)
+
+    match = _ON_DUPLICATE.search(query)
+    if match:
+        # 不写冲突目标时 SQLite 对任意唯一约束冲突执行更新，与 MySQL 一致；VALUES(col) 对应 excluded.col
+        head, tail = query[:match.start()], query[match.end():]
+        return (head + 'ON CONFLICT DO UPDATE SET' + _VALUES_REF.sub(r'excluded.\1', tail),)
+
+    return (query,)
+
+
+# ============ SQLite 连接 ============
+
+def _dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    """与 pymysql DictCursor 用法相同的游标"""
+
+    def __init__(self, db):
+        self._cursor = db.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def execute(self, query, args=None):
+        statements = translate_sql(query)
+        self._cursor.execute(statements[0], tuple(args or ()))
+        for statement in statements[1:]:
+            self._cursor.execute(statement)
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        statements = translate_sql(query)
+        self._cursor.executemany(statements[0], [tuple(row) for row in args])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """与 pymysql 连接用法相同的 SQLite 连接"""
+
+    def __init__(self, db):
+        self._db = db
+        self._db.row_factory = _dict_factory
+
+    def cursor(self):
+        return SQLiteCursor(self._db)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def ping(self, reconnect=False):
+        """本地文件没有断线重连的问题"""
+        return True
+
+    def close(self):
+        self._db.close()
+
+
+# ============ 后端 ============
+
+class StorageBackend:
+    """存储后端接口：connect() 返回 DictCursor 风格的连接"""
+
+    name = None
+
+    def prepare(self):
+        """启动前的准备工作（如生成数据库文件），默认什么都不做"""
+
+    def connect(self):
+        raise NotImplementedError
+
+    def describe(self):
+        return {'backend': self.name}
+
+
+class MySQLBackend(StorageBackend):
+    name = 'mysql'
+
+    def __init__(self, config):
+        """
+        Args:
+            config: pymysql.connect 的参数，游标默认为 DictCursor
+        """
+        self.config = config
+
+    def connect(self):
+        import pymysql
+        return pymysql.connect(**{'cursorclass': pymysql.cursors.DictCursor, **self.config})
+
+    def describe(self):
+        return {'backend': self.name, 'host': self.config.get('host'), 'database': self.config.get('database')}
+
+
+class SQLiteBackend(StorageBackend):
+    name = 'sqlite'
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, data_dir=DEFAULT_DATA_DIR, read_only=False):
+        """
+        Args:
+            path: 数据库文件路径
+            data_dir: 生成数据库所用的 CSV 目录
+            read_only: 只读不可变模式，不加锁、不读 WAL，适合多进程只读部署；
+                       数据库文件需事先生成，运行期间不能修改
+        """
+        self.path = path
+        self.data_dir = data_dir
+        self.read_only = read_only
+        self._prepared = False
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        """数据库文件不存在，或比任一 CSV 旧"""
+        if not os.path.exists(self.path):
+            return True
+        built_at = os.path.getmtime(self.path)
+        return any(
+            os.path.getmtime(os.path.join(self.data_dir, csv_name)) > built_at
+            for csv_name, _, _ in CSV_TABLES.values()
+            if os.path.exists(os.path.join(self.data_dir, csv_name))
+        )
+
+    def prepare(self):
+        """首次连接前检查数据库文件，缺失或过期时由 CSV 重新生成（只读模式下不生成）"""
+        if self._prepared:
+            return
+        with self._lock:
+            if self._prepared:
+                return
+            if self.read_only:
+                if not os.path.exists(self.path):
+                    raise FileNotFoundError(f"SQLite 数据库不存在: {self.path}，请先运行 python storage.py build")
+            elif self.is_stale():
+                build_sqlite(self.path, self.data_dir)
+            self._prepared = True
+
+    def connect(self):
+        self.prepare()
+        if self.read_only:
+            db = sqlite3.connect(f"file:{quote(self.path)}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+            db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            db.execute("PRAGMA query_only = 1")
+        else:
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA synchronous = NORMAL")
+        return SQLiteConnection(db)
+
+    def describe(self):
+        return {'backend': self.name, 'path': self.path, 'readOnly': self.read_only}
+
+
+def create_backend(config, mysql_config=None):
+    """
+    按配置创建存储后端
+
+    Args:
+        config: {'backend': 'mysql' / 'sqlite', 'sqlite_path': ..., 'data_dir': ..., 'read_only': bool}
+        mysql_config: MySQL 连接参数
+    """
+    backend = config.get('backend') or 'mysql'
+    if backend == 'mysql':
+        return MySQLBackend(mysql_config or {})
+    if backend == 'sqlite':
+        return SQLiteBackend(
+            path=config.get('sqlite_path') or DEFAULT_SQLITE_PATH,
+            data_dir=config.get('data_dir') or DEFAULT_DATA_DIR,
+            read_only=bool(config.get('read_only'))
+        )
+    raise ValueError(f"未知的存储后端: {backend}")
+
+
+def config_from_env():
+    """
+    从环境变量读取存储后端配置：'mysql' 使用 MYSQL_CONFIG；'sqlite' 使用由 data/*.csv 生成的内嵌数据库
+
+    HOUSING_STORAGE: mysql / sqlite；HOUSING_SQLITE_PATH: SQLite 文件路径；HOUSING_SQLITE_READ_ONLY=1: 只读模式
+    """
+    return {
+        'backend': os.environ.get('HOUSING_STORAGE', 'mysql'),
+        'sqlite_path': os.environ.get('HOUSING_SQLITE_PATH', DEFAULT_SQLITE_PATH),
+        'read_only': os.environ.get('HOUSING_SQLITE_READ_ONLY') == '1'
+    }
+
+
+@contextmanager
+def open_connection(config=None, mysql_config=None):
+    """
+    按存储后端配置打开数据库连接，供命令行工具使用，不必导入 app.py（Flask 应用及其后台线程）
+
+    Args:
+        config: 存储后端配置，默认取环境变量
+        mysql_config: MySQL 连接参数，默认 MYSQL_CONFIG
+    """
+    backend = create_backend(config or config_from_env(), mysql_config or MYSQL_CONFIG)
+    conn = None
+    try:
+        conn = backend.connect()
+        yield conn
+    except Exception as e:
+        print(f"数据库连接错误: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+# ============ 由 CSV 生成 SQLite 数据库 ============
+
+def _read_csv(path, columns):
+    import csv
+
+    def convert(value, column_type):
+        if value is None or value.strip() == '':
+            return None
+        if column_type.startswith('INTEGER'):
+            return int(float(value))
+        if column_type.startswith('REAL'):
+            return float(value)
+        return value.strip()
+
+    with open(path, encoding='utf-8-sig') as f:
+        return [tuple(convert(row.get(name), column_type) for name, column_type in columns.items())
+                for row in csv.DictReader(f)]
+
+
+def build_sqlite(path=DEFAULT_SQLITE_PATH, data_dir=DEFAULT_DATA_DIR):
+    """
+    由 data/*.csv 生成 SQLite 数据库：建表导入 → 城市维度和 city_id → 索引 → 数据版本 → 数据质量检查
+
+    先写到临时文件再替换，生成过程中其他进程读到的仍是旧文件
+
+    Returns:
+        dict: {表名: 行数}
+    """
+    from city_dim import sync_city_dim
+    from data_version import bump_version
+    from quality import run_quality_pass
+
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(temp_path + suffix):
+            os.remove(temp_path + suffix)
+
+    db = sqlite3.connect(temp_path)
+    db.execute("PRAGMA journal_mode = WAL")
+    conn = SQLiteConnection(db)
+    counts = {}
+    try:
+        for table_name, (csv_name, columns, time_columns) in CSV_TABLES.items():
+            csv_path = os.path.join(data_dir, csv_name)
+            rows = _read_csv(csv_path, columns) if os.path.exists(csv_path) else []
+            definition = ', '.join(f"{name} {column_type}" for name, column_type in columns.items())
+            db.execute(f"CREATE TABLE {table_name} ({definition})")
+            db.executemany(f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(columns))})", rows)
+            # 地图、排名竞速按时间查询全部城市
+            db.execute(f"CREATE INDEX idx_{table_name}_time ON {table_name} ({', '.join(time_columns)})")
+            db.commit()
+            counts[table_name] = len(rows)
+
+        # 统一城市名并回填 city_id、建 (city_id, 时间) 索引，与 MySQL 上 python city_dim.py sync 相同
+        sync_city_dim(conn, list(CSV_TABLES))
+        for table_name, count in counts.items():
+            bump_version(conn, table_name, cities=None, rows=count)
+            run_quality_pass(conn, table_name)
+
+        db.execute("ANALYZE")
+        db.commit()
+        # 把 WAL 全部写回主文件，只读不可变模式不读取 WAL
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        db.close()
+
+    # 旧库遗留的 WAL / 共享内存文件不能和新库混用
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(temp_path, path)
+    print(f"✅ SQLite 数据库已生成: {path}（"
+          + '，'.join(f"{name} {count} 行" for name, count in counts.items())
+          + f"，耗时 {time.perf_counter() - started:.2f} 秒）")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内嵌 SQLite 存储")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="由 CSV 生成 SQLite 数据库")
+    build_parser.add_argument('--path', default=DEFAULT_SQLITE_PATH, help="数据库文件路径")
+    build_parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="CSV 所在目录")
+
+    query_parser = subparsers.add_parser('query', help="用 MySQL 语法查询 SQLite 数据库")
+    query_parser.add_argument('sql')
+    query_parser.add_argument('--path', default=DEFAULT_SQLITE_PATH, help="数据库文件路径")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_sqlite(args.path, args.data_dir)
+    elif args.command == 'query':
+        conn = SQLiteBackend(args.path, read_only=True).connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(args.sql)
+                for row in cursor.fetchall():
+                    print(row)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
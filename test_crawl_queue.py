@@ -0,0 +1,119 @@
+# 爬取任务队列测试：本地桩服务器代替房价站点，临时 SQLite 文件作为任务队列
+# 运行：python -m pytest -q test_crawl_queue.py 或 python test_crawl_queue.py
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import crawl_queue
+
+# 桩服务器上返回 500 的城市代号
+FAILING_CODE = '500'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """/years/<城市代号>/<年份>/ 返回 12 个月的价格表格，FAILING_CODE 返回 500"""
+
+    def do_GET(self):
+        _, _, city_code, year, _ = self.path.split('/')
+        self.server.hits.append((city_code, time.monotonic()))
+        if city_code == FAILING_CODE:
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        rows = ''.join(f"<tr><td>{month}月</td><td>{10000 + int(year) + month}元/㎡</td></tr>"
+                       for month in range(1, 13))
+        body = f"<table class='ntable'><tr><th>月份</th><th>二手房</th></tr>{rows}</table>".encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CrawlQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.queue_path = os.path.join(self.tempdir.name, 'queue.db')
+        self.conn = crawl_queue.connect(self.queue_path)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.hits = []
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.conn.close()
+        self.tempdir.cleanup()
+
+    def job_state(self, city_code, year):
+        return self.conn.execute("SELECT * FROM crawl_jobs WHERE city_code = ? AND year = ?",
+                                 (city_code, year)).fetchone()
+
+    def test_claim_and_complete(self):
+        crawl_queue.enqueue_jobs(self.conn, {'1': 'Beijing'}, 2020, 2020)
+
+        processed = crawl_queue.run_worker(self.queue_path, worker_id='w1', base_url=self.base_url, delay=0)
+
+        self.assertEqual(processed, 1)
+        job = self.job_state('1', 2020)
+        self.assertEqual(job['state'], crawl_queue.DONE)
+        self.assertEqual(job['row_count'], 12)
+        self.assertIsNone(job['lease_owner'])
+        prices = self.conn.execute("SELECT month, price FROM crawl_results ORDER BY month").fetchall()
+        self.assertEqual([tuple(row) for row in prices], [(month, 12020 + month) for month in range(1, 13)])
+
+    def test_server_error_retries_with_backoff_then_fails(self):
+        crawl_queue.enqueue_jobs(self.conn, {FAILING_CODE: 'Broken'}, 2020, 2020, max_attempts=3)
+
+        crawl_queue.run_worker(self.queue_path, worker_id='w1', base_url=self.base_url, delay=0,
+                               retry_backoff=0.05)
+
+        job = self.job_state(FAILING_CODE, 2020)
+        self.assertEqual(job['state'], crawl_queue.FAILED)
+        self.assertEqual(job['attempts'], 3)
+        self.assertEqual(job['last_error'], 'HTTP 500')
+        # 第 n 次失败后至少等待 retry_backoff * 2^(n-1) 秒再重试
+        times = [at for _, at in self.server.hits]
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[1] - times[0], 0.05)
+        self.assertGreaterEqual(times[2] - times[1], 0.05 * 2)
+
+    def test_expired_lease_is_reclaimed(self):
+        crawl_queue.enqueue_jobs(self.conn, {'1': 'Beijing'}, 2020, 2020)
+        first = crawl_queue.claim_job(self.conn, 'w1', lease_seconds=0.05)
+        self.assertIsNone(crawl_queue.claim_job(self.conn, 'w2'))
+
+        time.sleep(0.1)
+        second = crawl_queue.claim_job(self.conn, 'w2')
+        self.assertEqual((second['city_code'], second['year']), ('1', 2020))
+        self.assertEqual(self.job_state('1', 2020)['attempts'], 2)
+
+        # 原 worker 的结果被丢弃，接管的 worker 可以正常完成
+        rows = [('Beijing', 2020, 1, 10000)]
+        self.assertFalse(crawl_queue.complete_job(self.conn, 'w1', first, rows))
+        self.assertTrue(crawl_queue.complete_job(self.conn, 'w2', second, rows))
+        self.assertEqual(self.job_state('1', 2020)['state'], crawl_queue.DONE)
+
+    def test_heartbeat_keeps_lease_while_fetching(self):
+        crawl_queue.enqueue_jobs(self.conn, {'1': 'Beijing'}, 2020, 2020)
+        job = crawl_queue.claim_job(self.conn, 'w1', lease_seconds=0.3)
+
+        with crawl_queue.lease_heartbeat(self.queue_path, 'w1', job, lease_seconds=0.3):
+            time.sleep(0.6)
+            self.assertIsNone(crawl_queue.claim_job(self.conn, 'w2'))
+
+        self.assertTrue(crawl_queue.complete_job(self.conn, 'w1', job, [('Beijing', 2020, 1, 10000)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# 启动预热：服务先开始监听，后台线程再依次导入重依赖、加载城市维度、预填接口缓存；
+# 预热完成前健康检查返回 warming，负载均衡不会把流量分给还没热好的 worker。
+# 所有耗时都从进程启动算起（包括解释器启动和模块导入），扩缩容时能看到新 worker 多久可用
+import os
+import threading
+import time
+import traceback
+
+_IMPORTED_AT = time.monotonic()
+
+
+def process_uptime():
+    """
+    进程已运行的秒数
+
+    Linux 下读 /proc（精度为一个时钟周期，通常 10ms），
+    其它平台退回到从本模块导入时算起
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # 第 2 个字段是带括号的进程名，可能含空格，从最后一个 ')' 之后开始数；starttime 是第 22 个字段
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            system_uptime = float(f.read().split()[0])
+        return max(system_uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'), 0.0)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _IMPORTED_AT
+
+
+# 进程启动时刻（monotonic 时钟），之后的耗时都相对它计算
+PROCESS_STARTED = time.monotonic() - process_uptime()
+
+
+def since_start():
+    """距进程启动的秒数"""
+    return time.monotonic() - PROCESS_STARTED
+
+
+class Warmup:
+    """按顺序在后台线程执行预热任务，并记录每步耗时和首个响应时间"""
+
+    def __init__(self):
+        self.state = 'idle'
+        self.tasks = []
+        self.results = {}
+        self.ready_at = None
+        self.first_byte = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, name, fn):
+        """登记一个预热任务，fn 为无参数函数"""
+        self.tasks.append((name, fn))
+
+    def task(self, name):
+        """装饰器形式的 add"""
+        def decorator(fn):
+            self.add(name, fn)
+            return fn
+        return decorator
+
+    def start(self):
+        """启动预热线程（重复调用无效）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = 'warming'
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """等待预热结束，返回是否已结束"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.state not in ('idle', 'warming')
+
+    def mark_first_byte(self):
+        """记录第一个业务响应距进程启动的时间，只记录一次"""
+        if self.first_byte is None:
+            with self._lock:
+                if self.first_byte is None:
+                    self.first_byte = since_start()
+                    print(f"📊 首个响应距进程启动 {self.first_byte:.3f} 秒")
+
+    def _run(self):
+        started = time.monotonic()
+        for name, fn in self.tasks:
+            task_started = time.monotonic()
+            try:
+                fn()
+                error = None
+            except Exception as e:
+                # 某一步失败不影响其它步骤，对应数据在首次请求时按需加载
+                print(f"⚠️  预热任务 {name} 失败: {e}")
+                traceback.print_exc()
+                error = str(e)
+            self.results[name] = {
+                'seconds': round(time.monotonic() - task_started, 3),
+                'error': error
+            }
+
+        self.ready_at = since_start()
+        failed = [name for name, result in self.results.items() if result['error']]
+        self.state = 'degraded' if failed else 'ready'
+        print(f"✅ 预热完成，耗时 {time.monotonic() - started:.2f} 秒，距进程启动 {self.ready_at:.2f} 秒"
+              + (f"（失败: {', '.join(failed)}）" if failed else ""))
+
+    def status(self):
+        """健康检查用的状态摘要"""
+        return {
+            'status': self.state,
+            'uptime': round(since_start(), 3),
+            'readyAt': round(self.ready_at, 3) if self.ready_at is not None else None,
+            'firstByte': round(self.first_byte, 3) if self.first_byte is not None else None,
+            'tasks': dict(self.results)
+        }
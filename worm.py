@@ -1,12 +1,29 @@
 # 爬虫文件，爬取相对应的信息
+# BeautifulSoup 和 pandas 导入较慢，在用到时才导入：爬取队列的 worker 只解析页面，用不到 pandas
 import requests
-from bs4 import BeautifulSoup
-import pandas as pd
 import time
 import re
 import os
 
-def get_house_price(city_code, city_name, year):
+BASE_URL = "https://fangjia.gotohui.com"
+
+# 常用城市代号，供批量爬取和爬取任务队列使用
+DEFAULT_CITIES = {
+    '2': 'Shanghai',       # 上海
+    '1': 'Beijing',        # 北京
+    '3': 'Guangzhou',      # 广州
+    '49': 'Shenzhen',      # 深圳
+    '6': 'Hangzhou',       # 杭州
+    '7': 'Nanjing',        # 南京
+    '108': 'Nanning',      # 南宁
+}
+
+
+class CrawlError(Exception):
+    """请求或解析失败（区别于页面正常但没有数据）"""
+
+
+def get_house_price(city_code, city_name, year, base_url=BASE_URL, raise_errors=False):
     """
     获取指定城市和年份的二手房价格数据
     
@@ -14,11 +31,15 @@ def get_house_price(city_code, city_name, year):
         city_code: 城市代号，如 'sh' (上海)
         city_name: 城市名称，如 'Shanghai'
         year: 年份，如 2015
+        base_url: 站点地址，测试时可指向本地桩服务器
+        raise_errors: 为 True 时请求失败抛出 CrawlError，而不是返回空列表
     
     Returns:
         list: 包含 (city_name, year, month, price) 的元组列表
     """
-    url = f"https://fangjia.gotohui.com/years/{city_code}/{year}/"
+    from bs4 import BeautifulSoup
+
+    url = f"{base_url}/years/{city_code}/{year}/"
     
     try:
         # 发送请求
@@ -30,6 +51,8 @@ def get_house_price(city_code, city_name, year):
         
         if response.status_code != 200:
             print(f"⚠️  {city_name} {year}年 - 请求失败，状态码: {response.status_code}")
+            if raise_errors:
+                raise CrawlError(f"HTTP {response.status_code}")
             return []
         
         # 解析HTML
@@ -42,6 +65,8 @@ def get_house_price(city_code, city_name, year):
         
         if not table:
             print(f"⚠️  {city_name} {year}年 - 未找到表格")
+            if raise_errors:
+                raise CrawlError("未找到表格")
             return []
         
         # 提取数据
@@ -70,8 +95,12 @@ def get_house_price(city_code, city_name, year):
         print(f"✅ {city_name} {year}年 - 成功获取 {len(data)} 条数据")
         return data
         
+    except CrawlError:
+        raise
     except Exception as e:
         print(f"❌ {city_name} {year}年 - 错误: {str(e)}")
+        if raise_errors:
+            raise CrawlError(str(e)) from e
         return []
 
 
@@ -102,6 +131,7 @@ def crawl_city_data(city_code, city_name, start_year=2015, end_year=2024):
         time.sleep(1)
     
     # 创建DataFrame
+    import pandas as pd
     df = pd.DataFrame(all_data, columns=['city_name', 'year', 'month', 'price'])
     
     print("-" * 50)
@@ -141,6 +171,7 @@ def crawl_multiple_cities(cities_dict, start_year=2015, end_year=2024, output_di
         time.sleep(1)
     
     # 合并所有城市数据
+    import pandas as pd
     final_df = pd.concat(all_cities_data, ignore_index=True)
     return final_df
 
@@ -184,17 +215,7 @@ if __name__ == "__main__":
     print("方式2: 批量爬取多个城市")
     print("=" * 60)
     
-    cities = {
-        '2': 'Shanghai',       # 上海
-        '1': 'Beijing',        # 北京
-        '3': 'Guangzhou',      # 广州
-        '49': 'Shenzhen',      # 深圳
-        '6': 'Hangzhou',       # 杭州
-        '7': 'Nanjing',        # 南京
-        # 添加更多城市...
-    }
-    
-    df_all = crawl_multiple_cities(cities, start_year=2015, end_year=2024, output_dir='./data')
+    df_all = crawl_multiple_cities(DEFAULT_CITIES, start_year=2015, end_year=2024, output_dir='./data')
     
     # 保存合并后的所有城市数据
     df_all.to_csv('./data/all_cities_house_price.csv', index=False, header=False, encoding='utf-8-sig')
@@ -0,0 +1,374 @@
+# 年度房价 XLSX 直接入库：流式逐行解析工作簿，校验并规范城市名，
+# 补算缺失的涨跌幅后写入 yearly_price_for_all，不再经过 xslx_to_csv.py 转一遍 CSV
+import argparse
+import os
+import time
+import tracemalloc
+import zipfile
+from xml.etree import ElementTree
+
+from city_dim import default_index, ensure_city_columns, ensure_city_tables, load_index, register_cities
+
+YEARLY_TABLE = 'yearly_price_for_all'
+UNIQUE_KEY_NAME = 'uk_city_year'
+
+# 表头别名（不区分大小写）
+HEADER_ALIASES = {
+    'city_name': 'city_name', 'city': 'city_name', '城市': 'city_name',
+    'year': 'year', '年份': 'year',
+    'price': 'price', '房价': 'price', '价格': 'price',
+    'change_rate': 'change_rate', 'changerate': 'change_rate', '涨跌幅': 'change_rate',
+}
+
+def normalize_city_name(name, index=None):
+    """
+    去掉多余空白并按城市维度表统一写法（拼音、中文名、常见错拼）
+
+    Args:
+        index: 城市索引，写库时传入从数据库加载的索引（含动态登记的城市），默认只用参考数据
+    """
+    if name is None or not str(name).split():
+        return None
+    return (index or default_index()).canonical_name(name)
+
+
+def _to_number(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _column_index(cell_ref):
+    """'C12' → 2"""
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _sheet_path(archive, sheet_name=None):
+    """根据 workbook.xml 和关系文件找到工作表在压缩包内的路径"""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheets = workbook.find(f'{_MAIN_NS}sheets')
+    target_id = None
+    for sheet in sheets:
+        if sheet_name is None or sheet.get('name') == sheet_name:
+            target_id = sheet.get(f'{_REL_NS}id')
+            break
+    if target_id is None:
+        raise ValueError(f"工作簿中没有工作表: {sheet_name}")
+
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels:
+        if rel.get('Id') == target_id:
+            target = rel.get('Target').lstrip('/')
+            return target if target.startswith('xl/') else f'xl/{target}'
+    raise ValueError(f"找不到工作表文件: {target_id}")
+
+
+def _shared_strings(archive):
+    """读取共享字符串表（城市名等文本单元格引用这里的下标）"""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        root = None
+        for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+            elif element.tag == f'{_MAIN_NS}si':
+                strings.append(''.join(text.text or '' for text in element.iter(f'{_MAIN_NS}t')))
+                # 处理完的 <si> 从根节点上摘掉，否则空元素会一直挂在树上
+                root.clear()
+    return strings
+
+
+def iter_sheet_values(path, sheet_name=None):
+    """
+    流式读取工作表的单元格值，每次产出一行（列表）
+
+    直接解析压缩包里的 XML，处理完的行从 <sheetData> 上摘掉，内存占用与行数无关（共享字符串表除外）；
+    比 openpyxl 只读模式少了逐个单元格建对象的开销
+    """
+    with zipfile.ZipFile(path) as archive:
+        strings = _shared_strings(archive)
+        with archive.open(_sheet_path(archive, sheet_name)) as f:
+            sheet_data = None
+            for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == f'{_MAIN_NS}sheetData':
+                        sheet_data = element
+                    continue
+                if element.tag != f'{_MAIN_NS}row':
+                    continue
+                values = []
+                for cell in element.iter(f'{_MAIN_NS}c'):
+                    ref = cell.get('r')
+                    if ref:
+                        index = _column_index(ref)
+                        values.extend([None] * (index - len(values)))
+                    cell_type = cell.get('t')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(f'{_MAIN_NS}t'))
+                    else:
+                        raw = cell.findtext(f'{_MAIN_NS}v')
+                        if raw is None:
+                            value = None
+                        elif cell_type == 's':
+                            value = strings[int(raw)]
+                        else:
+                            value = raw
+                    values.append(value)
+                # 已处理的行（包括当前行）都是 <sheetData> 的子节点，整体清掉
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    element.clear()
+                yield values
+
+
+def iter_workbook_rows(path, sheet_name=None):
+    """
+    逐行读取工作簿，第一行为表头
+
+    Yields:
+        dict: {'city_name', 'year', 'price', 'change_rate'} 原始值
+    """
+    rows = iter_sheet_values(path, sheet_name)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    columns = {}
+    for index, title in enumerate(header):
+        key = HEADER_ALIASES.get(str(title).strip().lower().replace(' ', '')) if title is not None else None
+        if key and key not in columns:
+            columns[key] = index
+    missing = {'city_name', 'year', 'price'} - set(columns)
+    if missing:
+        raise ValueError(f"工作簿缺少列: {', '.join(sorted(missing))}")
+
+    for row in rows:
+        yield {key: (row[index] if index < len(row) else None) for key, index in columns.items()}
+
+
+def parse_yearly_rows(raw_rows, index=None):
+    """
+    校验、规范化并补算涨跌幅
+
+    Args:
+        index: 规范城市名用的城市索引，见 normalize_city_name
+
+    Returns:
+        tuple: (rows, skipped)，rows 为按城市、年份排序的
+               [(city_name, year, price, change_rate), ...]
+    """
+    latest = {}
+    skipped = 0
+
+    for raw in raw_rows:
+        city = normalize_city_name(raw.get('city_name'), index)
+        year = _to_number(raw.get('year'))
+        price = _to_number(raw.get('price'))
+        change_rate = _to_number(raw.get('change_rate'))
+
+        if not city or year is None or price is None or price <= 0 or not 1900 < year < 2100:
+            skipped += 1
+            continue
+        # 同一城市同一年份出现多次时以后出现的为准
+        latest[(city, int(year))] = [price, change_rate]
+
+    rows = []
+    previous = None
+    for (city, year) in sorted(latest):
+        price, change_rate = latest[(city, year)]
+        if change_rate is None and previous and previous[0] == city and previous[1] == year - 1:
+            change_rate = round((price - previous[2]) / previous[2] * 100, 2)
+        rows.append((city, year, price, change_rate))
+        previous = (city, year, price)
+
+    return rows, skipped
+
+
+def ensure_yearly_table(conn, table_name=YEARLY_TABLE, unique_key=True):
+    """确保年度表存在，unique_key 为 True 时同时确保 (city_name, year) 唯一键"""
+    with conn.cursor() as cursor:
+        # 列类型与 pandas.to_sql 建表一致
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table_name} (
+                city_name TEXT,
+                year BIGINT,
+                price DOUBLE,
+                change_rate DOUBLE
+            )
+        """)
+        if unique_key:
+            cursor.execute(f"SHOW INDEX FROM {table_name} WHERE Key_name = %s", (UNIQUE_KEY_NAME,))
+            if not cursor.fetchone():
+                cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE KEY {UNIQUE_KEY_NAME} (city_name(64), year)")
+    conn.commit()
+
+
+def load_yearly_rows(conn, rows, mode='replace', table_name=YEARLY_TABLE, batch_size=1000):
+    """
+    写入年度表
+
+    Args:
+        mode: 'replace' 在一个事务里清空后重新写入（读者只会看到旧数据或新数据）；
+              'upsert' 只更新工作簿中出现的城市和年份
+    """
+    from data_version import bump_version
+
+    # 替换模式下唯一键在写入后再补建，避免旧数据中的重复行导致建索引失败
+    ensure_yearly_table(conn, table_name, unique_key=(mode != 'replace'))
+    ensure_city_columns(conn, table_name)
+
+    # 写入城市维度表中的城市名和整数城市ID（与 import_data.py、爬虫写入的一致），查询时按 city_id 过滤
+    cities = register_cities(conn, {row[0] for row in rows})
+    rows = [(cities[city]['city_name'], cities[city]['city_id'], year, price, change_rate)
+            for city, year, price, change_rate in rows]
+
+    try:
+        with conn.cursor() as cursor:
+            if mode == 'replace':
+                cursor.execute(f"DELETE FROM {table_name}")
+                query = f"""
+                    INSERT INTO {table_name} (city_name, city_id, year, price, change_rate)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+            else:
+                query = f"""
+                    INSERT INTO {table_name} (city_name, city_id, year, price, change_rate)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        city_id = VALUES(city_id), price = VALUES(price), change_rate = VALUES(change_rate)
+                """
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(query, rows[start:start + batch_size])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if mode == 'replace':
+        ensure_yearly_table(conn, table_name)
+
+    cities = None if mode == 'replace' else {row[0] for row in rows}
+    return bump_version(conn, table_name, cities=cities, rows=len(rows))
+
+
+def benchmark(path):
+    """对比旧流程（pandas 读 XLSX → 写 CSV → 再读 CSV）与流式解析的耗时和峰值内存"""
+    import tempfile
+    import pandas as pd
+
+    def measure(fn):
+        # 耗时与内存分两次测量，tracemalloc 本身会明显拖慢解析
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak / 1024 / 1024
+
+    def old_path():
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'long_format_yearly_price.csv')
+            pd.read_excel(path).to_csv(csv_path, index=False)
+            return len(pd.read_csv(csv_path))
+
+    def new_path():
+        rows, _ = parse_yearly_rows(iter_workbook_rows(path))
+        return len(rows)
+
+    def openpyxl_path():
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        count = sum(1 for _ in workbook.active.iter_rows(values_only=True)) - 1
+        workbook.close()
+        return count
+
+    for name, fn in [('read_excel → CSV → read_csv', old_path),
+                     ('openpyxl read-only (scan only)', openpyxl_path),
+                     ('streaming XML (parse + check)', new_path)]:
+        count, elapsed, peak = measure(fn)
+        print(f"{name:30s} rows={count:8d}  {elapsed:7.2f} s  peak {peak:8.1f} MB")
+
+
+def write_sample_workbook(path, source_csv, repeat):
+    """用 data/yearly_price.csv 生成大工作簿（城市名加编号重复 repeat 次），用于基准测试"""
+    import csv
+    from openpyxl import Workbook
+
+    with open(source_csv, encoding='utf-8-sig') as f:
+        source = list(csv.DictReader(f))
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(['city_name', 'year', 'price', 'change_rate'])
+    for i in range(repeat):
+        for row in source:
+            sheet.append([f"{row['city_name']} {i}", int(row['year']),
+                          float(row['price']), float(row['change_rate']) if row['change_rate'] else None])
+    workbook.save(path)
+
+
+def parse_workbook(path, sheet_name=None, index=None):
+    """解析工作簿并打印校验结果，返回 parse_yearly_rows 的有效行"""
+    started = time.perf_counter()
+    rows, skipped = parse_yearly_rows(iter_workbook_rows(path, sheet_name), index)
+    print(f"✅ 解析完成：有效 {len(rows)} 行，跳过 {skipped} 行，耗时 {time.perf_counter() - started:.2f} 秒")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="年度房价 XLSX 直接导入数据库")
+    parser.add_argument('path', nargs='?', default='./data/long_format_yearly_price.xlsx', help="工作簿路径")
+    parser.add_argument('--sheet', help="工作表名，默认第一个")
+    parser.add_argument('--mode', choices=['replace', 'upsert'], default='replace', help="整表替换或按城市年份更新")
+    parser.add_argument('--dry-run', action='store_true', help="只解析校验，不写数据库")
+    parser.add_argument('--bench', action='store_true', help="与旧的转CSV流程对比耗时和内存")
+    parser.add_argument('--make-sample', type=int, metavar='REPEAT',
+                        help="用 data/yearly_price.csv 生成放大 REPEAT 倍的工作簿到 path")
+    args = parser.parse_args()
+
+    if args.make_sample:
+        source_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'yearly_price.csv')
+        write_sample_workbook(args.path, source_csv, args.make_sample)
+        print(f"💾 示例工作簿已保存到: {args.path}")
+        return
+
+    if args.bench:
+        benchmark(args.path)
+        return
+
+    if args.dry_run:
+        parse_workbook(args.path, args.sheet)
+        return
+
+    # quality 依赖 NumPy，只在真正写库时才导入，--help / --dry-run 不加载
+    from quality import run_quality_pass
+    from storage import open_connection
+    with open_connection() as conn:
+        # 按数据库中的城市索引规范城市名，动态登记过的城市与其他导入方式写成同一个名字
+        ensure_city_tables(conn)
+        rows = parse_workbook(args.path, args.sheet, load_index(conn))
+        version = load_yearly_rows(conn, rows, args.mode)
+        print(f"✅ 已导入 {YEARLY_TABLE}，数据版本 {version}")
+        run_quality_pass(conn, YEARLY_TABLE)
+
+
+if __name__ == "__main__":
+    main()